@@ -0,0 +1,97 @@
+"""Memory used by parsed dbt models with and without interning
+
+Builds a synthetic project in which column descriptions come from a small
+set of reused docs blocks, as is common in large dbt projects, and compares
+the memory held by the parsed models before and after interning.
+
+    python benchmarks/interning_memory.py --models 2000 --columns 30
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from dbt2looker import interning
+from dbt2looker import parser
+
+DOCS_BLOCKS = [
+    f'Shared docs block {i}. ' + 'Describes a column that appears in many models. ' * 8
+    for i in range(20)
+]
+COLUMN_TYPES = ['INT64', 'STRING', 'TIMESTAMP', 'DATE', 'NUMERIC', 'BOOLEAN']
+
+
+def synthetic_artifacts(model_count: int, column_count: int):
+    nodes = {}
+    catalog_nodes = {}
+    for m in range(model_count):
+        unique_id = f'model.bench.model_{m}'
+        columns = {
+            f'column_{c}': {
+                'name': f'column_{c}',
+                'description': DOCS_BLOCKS[(m + c) % len(DOCS_BLOCKS)],
+                'meta': {},
+            }
+            for c in range(column_count)
+        }
+        nodes[unique_id] = {
+            'unique_id': unique_id,
+            'resource_type': 'model',
+            'relation_name': f'"db"."analytics"."model_{m}"',
+            'schema': 'analytics',
+            'name': f'model_{m}',
+            'description': DOCS_BLOCKS[m % len(DOCS_BLOCKS)],
+            'columns': columns,
+            'tags': ['looker', 'prod'],
+            'config': {'meta': {}},
+        }
+        catalog_nodes[unique_id] = {
+            'metadata': {'type': 'table', 'schema': 'analytics', 'name': f'model_{m}', 'comment': None, 'owner': None},
+            'columns': {
+                f'column_{c}': {'type': COLUMN_TYPES[c % len(COLUMN_TYPES)], 'comment': None, 'index': c, 'name': f'column_{c}'}
+                for c in range(column_count)
+            },
+        }
+    raw_manifest = {'metadata': {'adapter_type': 'postgres'}, 'nodes': nodes}
+    raw_catalog = {'nodes': catalog_nodes}
+    # Round trip through json so that every string is a separate object, as
+    # when decoding manifest.json and catalog.json
+    return json.loads(json.dumps(raw_manifest)), json.loads(json.dumps(raw_catalog))
+
+
+def traced_memory() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--models', type=int, default=2000)
+    argparser.add_argument('--columns', type=int, default=30)
+    args = argparser.parse_args()
+
+    intern_models = interning.intern_models
+    tracemalloc.start()
+    baseline = traced_memory()
+
+    # Parse without interning, then drop the raw artifacts so that only the
+    # parsed models remain
+    interning.intern_models = lambda dbt_models: dbt_models
+    raw_manifest, raw_catalog = synthetic_artifacts(args.models, args.columns)
+    dbt_models = parser.parse_typed_models(raw_manifest, raw_catalog)
+    del raw_manifest, raw_catalog
+    before = traced_memory() - baseline
+
+    intern_models(dbt_models)
+    after = traced_memory() - baseline
+    interning.intern_models = intern_models
+    tracemalloc.stop()
+
+    print(f'{args.models} models x {args.columns} columns, {len(DOCS_BLOCKS)} docs blocks')
+    print(f'Parsed models without interning: {before / 2 ** 20:8.1f} MiB')
+    print(f'Parsed models with interning:    {after / 2 ** 20:8.1f} MiB')
+    print(f'Reduction:                       {100 * (before - after) / before:8.1f} %')
+
+
+if __name__ == '__main__':
+    main()
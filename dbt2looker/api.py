@@ -0,0 +1,130 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from . import generator
+from . import metrics
+from . import models
+from . import parser
+from . import validator
+
+
+class GeneratedLookml(NamedTuple):
+    views: List[models.LookViewFile]
+    models: List[models.LookModelFile]
+    # Invalid field references found by validator.validate_lookml
+    validation_errors: List[str]
+
+
+class Project(NamedTuple):
+    raw_manifest: dict
+    raw_catalog: dict
+    typed_dbt_models: List[models.DbtModel]
+    adapter_type: str
+    connection_name: str
+    # Relationships tests by unique id of the tested model
+    relationships: Dict[str, List[models.DbtRelationship]]
+    # Build times from run_results.json and earlier runs, only read for datagroups
+    build_times: Optional[models.DbtBuildTimes] = None
+    datagroups: Optional[str] = None
+
+
+def artifact_to_dict(artifact) -> dict:
+    """Dict form of a dbt artifact: a dict, a dbt Manifest or a dbt artifact object such as CatalogArtifact"""
+    if isinstance(artifact, dict):
+        return artifact
+    if hasattr(artifact, 'writable_manifest'):
+        artifact = artifact.writable_manifest()
+    if hasattr(artifact, 'to_dict'):
+        return artifact.to_dict()
+    raise TypeError(f'Cannot read a dbt artifact from {type(artifact).__name__}, expected a dict or an object with a to_dict method')
+
+
+def parse_project(
+    raw_manifest: dict,
+    raw_catalog: dict,
+    connection_name: str,
+    tag: Optional[str] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    raw_run_results: Optional[dict] = None,
+    datagroups: Optional[str] = None,
+    unique_ids: Optional[List[str]] = None,
+    previous_build_times: Optional[models.DbtBuildTimes] = None,
+) -> Project:
+    """Parse the raw dbt artifacts into everything lookml is generated from
+
+    The command line, the server and generate_lookml all go through this
+    function, get_view_dicts and get_model_dicts. With unique_ids, lookml is
+    only generated for those models, other models in the artifacts are only
+    used to infer joins. Build times of models that were not part of the
+    latest dbt run are taken from previous_build_times.
+    """
+    with metrics.stage('parse'):
+        typed_dbt_models = parser.parse_typed_models(raw_manifest, raw_catalog, tag=tag, shard=shard, unique_ids=unique_ids)
+        adapter_type = parser.parse_adapter_type(raw_manifest)
+        relationships = parser.parse_relationships(raw_manifest, raw_catalog, tag=tag)
+        build_times = parser.merge_build_times(
+            previous_build_times,
+            parser.parse_run_results(raw_run_results, raw_manifest),
+        ) if datagroups else None
+    generator.count_unsupported_columns(typed_dbt_models, adapter_type)
+    return Project(
+        raw_manifest,
+        raw_catalog,
+        typed_dbt_models,
+        adapter_type,
+        connection_name,
+        relationships,
+        build_times,
+        datagroups,
+    )
+
+
+def get_view_dicts(project: Project, dbt_models: List[models.DbtModel]) -> List[dict]:
+    return [
+        generator.lookml_view_dict_from_dbt_model(model, project.adapter_type)
+        for model in dbt_models
+    ]
+
+
+def get_model_dicts(project: Project, dbt_models: List[models.DbtModel]) -> List[dict]:
+    model_dicts = [
+        generator.lookml_model_dict_from_dbt_model(model, project.connection_name, project.relationships.get(model.unique_id), project.adapter_type)
+        for model in dbt_models
+    ]
+    if project.datagroups:
+        model_dicts = [
+            generator.lookml_persist_with_datagroup(lookml, model, project.build_times, project.datagroups)
+            for lookml, model in zip(model_dicts, dbt_models)
+        ]
+    return model_dicts
+
+
+def generate_lookml(
+    manifest,
+    catalog,
+    connection_name: str,
+    tag: Optional[str] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    run_results=None,
+    datagroups: Optional[str] = None,
+) -> GeneratedLookml:
+    """Generate lookml views and models from in-memory manifest and catalog, without any file I/O
+
+    With run_results and datagroups set to "model" or "tag", explores persist with a datagroup
+    triggered by dbt builds, as with the --datagroups option.
+    """
+    project = parse_project(
+        artifact_to_dict(manifest),
+        artifact_to_dict(catalog),
+        connection_name,
+        tag=tag,
+        shard=shard,
+        raw_run_results=artifact_to_dict(run_results) if run_results is not None else None,
+        datagroups=datagroups if run_results is not None else None,
+    )
+    view_dicts = get_view_dicts(project, project.typed_dbt_models)
+    model_dicts = get_model_dicts(project, project.typed_dbt_models)
+    return GeneratedLookml(
+        views=[generator.lookml_view_file(view) for view in view_dicts],
+        models=[generator.lookml_model_file(model) for model in model_dicts],
+        validation_errors=validator.validate_lookml(view_dicts, model_dicts),
+    )
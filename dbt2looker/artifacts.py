@@ -0,0 +1,332 @@
+import contextlib
+import gzip
+import json
+import logging
+import lzma
+import mmap
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Artifacts may be read compressed, e.g. manifest.json.zst cached by CI
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.zst': 'zstd',
+    '.xz': 'xz',
+}
+COMPRESSION_MAGIC_BYTES = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+    b'\xfd7zXZ\x00': 'xz',
+}
+
+# Sidecar index mapping each unique_id in a dbt artifact (manifest.json,
+# catalog.json) to the byte range of its node, so that a handful of nodes can
+# be decoded without parsing the whole file.
+INDEX_VERSION = 3
+INDEX_SUFFIX = '.dbt2looker-index.json'
+NODE_SECTIONS = ('nodes', 'sources')
+# child_map is indexed to find the tests of selected models
+INDEXED_SECTIONS = NODE_SECTIONS + ('child_map',)
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def find_artifact(prefix: str, filename: str) -> str:
+    """Path to an artifact in the target directory, preferring the uncompressed file"""
+    path = os.path.join(prefix, filename)
+    for candidate in [path] + [path + extension for extension in COMPRESSION_EXTENSIONS]:
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(path)
+
+
+def detect_compression(path: str) -> Optional[str]:
+    _, extension = os.path.splitext(path)
+    if extension in COMPRESSION_EXTENSIONS:
+        return COMPRESSION_EXTENSIONS[extension]
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, compression in COMPRESSION_MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+@contextlib.contextmanager
+def open_artifact(path: str):
+    """Binary stream over an artifact, decompressing on the fly"""
+    compression = detect_compression(path)
+    with open(path, 'rb') as raw:
+        if compression is None:
+            yield raw
+        elif compression == 'gzip':
+            with gzip.GzipFile(fileobj=raw) as f:
+                yield f
+        elif compression == 'xz':
+            with lzma.LZMAFile(raw) as f:
+                yield f
+        else:
+            if zstandard is None:
+                logging.error(f'Reading zstd compressed artifact {path} requires the zstandard package. Install it with "pip install zstandard".')
+                raise SystemExit('Failed')
+            with zstandard.ZstdDecompressor().stream_reader(raw) as f:
+                yield f
+
+
+def load_artifact(path: str) -> dict:
+    with open_artifact(path) as f:
+        return json.load(f)
+
+
+def artifact_fingerprint(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def index_path_for(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+class _ByteOffsets:
+    """Byte offsets of increasing character offsets into a decoded artifact"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.is_ascii = text.isascii()
+        self.char_offset = 0
+        self.byte_offset = 0
+
+    def __call__(self, char_offset: int) -> int:
+        if self.is_ascii:
+            return char_offset
+        self.byte_offset += len(self.text[self.char_offset:char_offset].encode('utf-8'))
+        self.char_offset = char_offset
+        return self.byte_offset
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _expect(text: str, pos: int, char: str) -> int:
+    if text[pos:pos + 1] != char:
+        raise ValueError(f'Expected "{char}" at offset {pos} of artifact')
+    return _skip_whitespace(text, pos + 1)
+
+
+def _object_members(text: str, pos: int):
+    """Yield (key, value start) of the object starting at pos, the caller decodes each value and sends back its end"""
+    pos = _expect(text, pos, '{')
+    if text[pos:pos + 1] == '}':
+        return pos + 1
+    while True:
+        if text[pos:pos + 1] != '"':
+            raise ValueError(f'Expected a key at offset {pos} of artifact')
+        key, pos = json.decoder.scanstring(text, pos + 1)
+        pos = _expect(text, _skip_whitespace(text, pos), ':')
+        end = yield key, pos
+        pos = _skip_whitespace(text, end)
+        if text[pos:pos + 1] == '}':
+            return pos + 1
+        pos = _expect(text, pos, ',')
+
+
+def scan_artifact(contents: bytes) -> Tuple[Dict[str, List[int]], Dict[str, Dict[str, List[int]]]]:
+    """Find byte ranges of top level values and of each entry in the indexed sections
+
+    Values are decoded with the json module's C decoder to find where they
+    end, so scanning costs about as much as loading the artifact once.
+    """
+    text = contents.decode('utf-8')
+    byte_offset = _ByteOffsets(text)
+    top_level = {}
+    entries = {section: {} for section in INDEXED_SECTIONS}
+    members = _object_members(text, _skip_whitespace(text, 0))
+    try:
+        key, start = next(members)
+        while True:
+            if key in entries and text[start:start + 1] == '{':
+                section_start = byte_offset(start)
+                section = _object_members(text, start)
+                try:
+                    entry_key, entry_start = next(section)
+                    while True:
+                        _, entry_end = _decoder.raw_decode(text, entry_start)
+                        entries[key][entry_key] = [byte_offset(entry_start), byte_offset(entry_end)]
+                        entry_key, entry_start = section.send(entry_end)
+                except StopIteration as stop:
+                    end = stop.value
+                top_level[key] = [section_start, byte_offset(end)]
+            else:
+                _, end = _decoder.raw_decode(text, start)
+                top_level[key] = [byte_offset(start), byte_offset(end)]
+            key, start = members.send(end)
+    except StopIteration:
+        pass
+    return top_level, entries
+
+
+def build_artifact_index(path: str) -> dict:
+    fingerprint = artifact_fingerprint(path)
+    with open(path, 'rb') as f:
+        top_level, entries = scan_artifact(f.read())
+    logging.debug('Indexed %d nodes in %s', sum(len(e) for e in entries.values()), path)
+    return {
+        'version': INDEX_VERSION,
+        'fingerprint': fingerprint,
+        'top_level': top_level,
+        'entries': entries,
+    }
+
+
+def load_artifact_index(path: str) -> dict:
+    """Load the sidecar index for an artifact, rebuilding it if the artifact changed since it was written"""
+    index_path = index_path_for(path)
+    fingerprint = artifact_fingerprint(path)
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get('version') == INDEX_VERSION and index.get('fingerprint') == fingerprint:
+            logging.debug('Using artifact index at %s', index_path)
+            return index
+        logging.debug('Artifact index at %s is stale, rebuilding', index_path)
+    except (FileNotFoundError, ValueError):
+        pass
+    index = build_artifact_index(path)
+    try:
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+    except OSError as e:
+        logging.debug('Could not write artifact index to %s: %s', index_path, e)
+    return index
+
+
+def resolve_unique_ids(entries: Iterable[str], selectors: Iterable[str]) -> List[str]:
+    """Map model names or unique_ids to unique_ids present in the artifact"""
+    unique_ids = []
+    for selector in selectors:
+        if selector in entries:
+            unique_ids.append(selector)
+            continue
+        matches = [
+            unique_id for unique_id in entries
+            if unique_id.startswith('model.') and unique_id.endswith(f'.{selector}')
+        ]
+        if not matches:
+            logging.warning('No model matching "%s" found in manifest', selector)
+        unique_ids.extend(matches)
+    return unique_ids
+
+
+class ArtifactReader:
+    """Reads top level sections and individual nodes of an artifact
+
+    Uncompressed artifacts are memory-mapped and read through the sidecar
+    index. Compressed artifacts cannot be memory-mapped, they are decoded in
+    full once and all reads use the decoded artifact.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.raw_artifact = None
+        self.index = None
+        self._file = None
+        self._buffer = None
+        if detect_compression(path) is not None:
+            self.raw_artifact = load_artifact(path)
+        else:
+            self.index = load_artifact_index(path)
+            self._file = open(path, 'rb')
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._file.close()
+            self._buffer = self._file = None
+
+    def node_ids(self, section: str = 'nodes') -> Iterable[str]:
+        if self.raw_artifact is not None:
+            return self.raw_artifact.get(section, {}).keys()
+        return self.index['entries'][section].keys()
+
+    def top_level(self, key: str):
+        if self.raw_artifact is not None:
+            return self.raw_artifact.get(key)
+        if key not in self.index['top_level']:
+            return None
+        start, end = self.index['top_level'][key]
+        return json.loads(self._buffer[start:end])
+
+    def node(self, section: str, unique_id: str) -> Optional[dict]:
+        if self.raw_artifact is not None:
+            return self.raw_artifact.get(section, {}).get(unique_id)
+        byte_range = self.index['entries'][section].get(unique_id)
+        if byte_range is None:
+            return None
+        start, end = byte_range
+        return json.loads(self._buffer[start:end])
+
+    def subset(self, unique_ids: Iterable[str]) -> dict:
+        """The top level metadata and the given nodes of the artifact"""
+        subset = {section: {} for section in NODE_SECTIONS}
+        metadata = self.top_level('metadata')
+        if metadata is not None:
+            subset['metadata'] = metadata
+        for unique_id in unique_ids:
+            for section in NODE_SECTIONS:
+                node = self.node(section, unique_id)
+                if node is not None:
+                    subset[section][unique_id] = node
+        return subset
+
+
+def select_artifact_subset(path: str, selectors: Iterable[str]) -> Tuple[List[str], dict]:
+    """Resolve model names or unique_ids and decode only their nodes, reading the artifact once"""
+    with ArtifactReader(path) as reader:
+        unique_ids = resolve_unique_ids(reader.node_ids(), selectors)
+        return unique_ids, reader.subset(unique_ids)
+
+
+def select_manifest_subset(path: str, selectors: Iterable[str]) -> Tuple[List[str], dict]:
+    """Like select_artifact_subset, also decoding the relationships tests of the selected models and the models they reference
+
+    The tests are found through the manifest's child_map, so that joins
+    inferred for a selected model match those of a full run.
+    """
+    with ArtifactReader(path) as reader:
+        unique_ids = resolve_unique_ids(reader.node_ids(), selectors)
+        related_ids = []
+        for unique_id in unique_ids:
+            for child_id in reader.node('child_map', unique_id) or []:
+                if not child_id.startswith('test.'):
+                    continue
+                test = reader.node('nodes', child_id) or {}
+                if (test.get('test_metadata') or {}).get('name') != 'relationships':
+                    continue
+                related_ids.append(child_id)
+                related_ids += [
+                    parent_id
+                    for parent_id in (test.get('depends_on') or {}).get('nodes', [])
+                    if parent_id.startswith('model.')
+                ]
+        subset_ids = list(dict.fromkeys(unique_ids + related_ids))
+        return unique_ids, reader.subset(subset_ids)
+
+
+def read_artifact_subset(path: str, unique_ids: Iterable[str]) -> dict:
+    """Decode only the top level metadata and the given nodes of an artifact"""
+    with ArtifactReader(path) as reader:
+        return reader.subset(unique_ids)
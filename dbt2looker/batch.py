@@ -0,0 +1,115 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Tuple
+
+# Options that are paths, resolved relative to the batch config file
+PATH_OPTIONS = ('project_dir', 'target_dir', 'output_dir', 'output_index', 'metrics_file')
+
+
+class BatchConfig(NamedTuple):
+    jobs: int
+    # Run jobs in worker processes instead of threads
+    processes: bool
+    # Name and command line arguments of "dbt2looker" for each project
+    projects: List[Tuple[str, List[str]]]
+
+
+def options_to_argv(options: dict, config_dir: str) -> List[str]:
+    argv = []
+    for key, value in options.items():
+        if value is None or value is False:
+            continue
+        if key in PATH_OPTIONS and isinstance(value, str):
+            value = os.path.join(config_dir, value)
+        flag = '--' + key.replace('_', '-')
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, list):
+            argv += [flag, *(str(v) for v in value)]
+        else:
+            argv += [flag, str(value)]
+    return argv
+
+
+def parse_batch_config(raw_config: dict, config_dir: str) -> BatchConfig:
+    """Parse a batch config
+
+    jobs: 4                 # optional, projects generated concurrently
+    processes: true         # optional, run jobs in worker processes
+    defaults:               # optional, options applied to every project
+      tag: looker
+    projects:
+      - name: analytics     # optional, used in the report
+        project_dir: ../analytics
+        target_dir: ../analytics/target
+        output_dir: ./lookml/analytics
+    """
+    defaults = raw_config.get('defaults') or {}
+    projects = raw_config.get('projects') or []
+    if not projects:
+        logging.error('Batch config does not list any projects')
+        raise SystemExit('Failed')
+    return BatchConfig(
+        jobs=int(raw_config.get('jobs', 1)),
+        processes=bool(raw_config.get('processes', False)),
+        projects=[
+            (
+                project.get('name') or project.get('project_dir') or f'project {i}',
+                options_to_argv({key: value for key, value in {**defaults, **project}.items() if key != 'name'}, config_dir),
+            )
+            for i, project in enumerate(projects, 1)
+        ],
+    )
+
+
+def _run_project(name: str, args, generate: Callable) -> dict:
+    logging.info('Generating lookml for %s', name)
+    started = time.perf_counter()
+    try:
+        summary = generate(args)
+        status = 'success'
+        error = None
+    except (Exception, SystemExit) as e:
+        logging.error('Failed to generate lookml for %s: %s', name, e)
+        summary = {}
+        status = 'failed'
+        error = str(e)
+    return {
+        'project': name,
+        'output_dir': args.output_dir,
+        'status': status,
+        'error': error,
+        'seconds': round(time.perf_counter() - started, 3),
+        **summary,
+    }
+
+
+def run_projects(projects: List[Tuple[str, object]], generate: Callable, jobs: int = 1, processes: bool = False) -> List[dict]:
+    """Generate every project, in threads of this process or in worker processes
+
+    Threads share imports and caches, but parsing and rendering hold the GIL,
+    so concurrent threads mostly overlap reading artifacts and writing files.
+    Worker processes generate projects in parallel on several cores, each with
+    its own caches.
+    """
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_class(max_workers=max(jobs, 1)) as executor:
+        futures = [executor.submit(_run_project, name, args, generate) for name, args in projects]
+        return [future.result() for future in futures]
+
+
+def format_report(results: List[dict]) -> List[str]:
+    lines = [
+        f'{result["status"]:<8} {result["seconds"]:>8.2f}s  '
+        f'{result.get("views", 0):>5} views  {result.get("models", 0):>5} models  {result["project"]}'
+        for result in results
+    ]
+    failed = sum(result['status'] != 'success' for result in results)
+    lines.append(
+        f'Generated {len(results) - failed} of {len(results)} projects, '
+        f'{sum(result.get("views", 0) for result in results)} views, '
+        f'{sum(result["seconds"] for result in results):.2f}s total project time'
+    )
+    return lines
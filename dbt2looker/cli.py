@@ -1,8 +1,11 @@
 import argparse
+import functools
 import json
 import logging
 import pathlib
 import os
+import sys
+from typing import List, Optional
 try:
     from importlib.metadata import version
 except ImportError:
@@ -15,18 +18,34 @@ except ImportError:
     from yaml import Loader
 
 
+from . import api
+from . import artifacts
+from . import batch
 from . import parser
 from . import generator
+from . import metrics
+from . import models
+from . import output
+from . import plan
+from . import server
+from . import sharding
+from . import validator
 
 MANIFEST_PATH = './manifest.json'
 DEFAULT_LOOKML_OUTPUT_DIR = './lookml'
+OUTPUT_INDEX_IN_OUTPUT_DIR = '<output-dir>'
+
+
+@functools.lru_cache(maxsize=None)
+def get_version():
+    return version('dbt2looker')
 
 
 def get_manifest(prefix: str):
     manifest_path = os.path.join(prefix, 'manifest.json')
     try:
-        with open(manifest_path, 'r') as f:
-            raw_manifest = json.load(f)
+        manifest_path = artifacts.find_artifact(prefix, 'manifest.json')
+        raw_manifest = artifacts.load_artifact(manifest_path)
     except FileNotFoundError as e:
         logging.error(f'Could not find manifest file at {manifest_path}. Use --target-dir to change the search path for the manifest.json file.')
         raise SystemExit('Failed')
@@ -34,11 +53,26 @@ def get_manifest(prefix: str):
     return raw_manifest
 
 
-def get_catalog(prefix: str):
+def get_selected_manifest(prefix: str, select: List[str]):
+    manifest_path = os.path.join(prefix, 'manifest.json')
+    try:
+        manifest_path = artifacts.find_artifact(prefix, 'manifest.json')
+        unique_ids, raw_manifest = artifacts.select_manifest_subset(manifest_path, select)
+    except FileNotFoundError as e:
+        logging.error(f'Could not find manifest file at {manifest_path}. Use --target-dir to change the search path for the manifest.json file.')
+        raise SystemExit('Failed')
+    logging.debug(f'Detected manifest at {manifest_path}')
+    return unique_ids, raw_manifest
+
+
+def get_catalog(prefix: str, unique_ids: Optional[List[str]] = None):
     catalog_path = os.path.join(prefix, 'catalog.json')
     try:
-        with open(catalog_path, 'r') as f:
-            raw_catalog = json.load(f)
+        catalog_path = artifacts.find_artifact(prefix, 'catalog.json')
+        if unique_ids is None:
+            raw_catalog = artifacts.load_artifact(catalog_path)
+        else:
+            raw_catalog = artifacts.read_artifact_subset(catalog_path, unique_ids)
     except FileNotFoundError as e:
         logging.error(f'Could not find catalog file at {catalog_path}. Use --target-dir to change the search path for the catalog.json file.')
         raise SystemExit('Failed')
@@ -46,6 +80,18 @@ def get_catalog(prefix: str):
     return raw_catalog
 
 
+def get_run_results(prefix: str):
+    run_results_path = os.path.join(prefix, 'run_results.json')
+    try:
+        run_results_path = artifacts.find_artifact(prefix, 'run_results.json')
+        raw_run_results = artifacts.load_artifact(run_results_path)
+    except FileNotFoundError as e:
+        logging.error(f'Could not find run results file at {run_results_path}. Use --target-dir to change the search path for the run_results.json file.')
+        raise SystemExit('Failed')
+    logging.debug(f'Detected run results at {run_results_path}')
+    return raw_run_results
+
+
 def get_dbt_project_config(prefix: str):
     project_path  = os.path.join(prefix, 'dbt_project.yml')
     try:
@@ -58,13 +104,58 @@ def get_dbt_project_config(prefix: str):
     return project_config
 
 
-def run():
-    argparser = argparse.ArgumentParser()
+def shard_type(value: str):
+    try:
+        return sharding.parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def add_log_level_argument(argparser: argparse.ArgumentParser):
     argparser.add_argument(
-        '--version',
-        action='version',
-        version=f'dbt2looker {version("dbt2looker")}',
+        '--log-level',
+        help='Set level of logs. Default is INFO',
+        choices=['DEBUG', 'INFO', 'WARN', 'ERROR'],
+        type=str,
+        default='INFO',
+    )
+
+
+def configure_logging(log_level: str):
+    logging.basicConfig(
+        level=getattr(logging, log_level),
+        format='%(asctime)s %(levelname)-6s %(message)s',
+        datefmt='%H:%M:%S',
+    )
+
+
+def run_merge(argv: List[str]):
+    argparser = argparse.ArgumentParser(
+        prog='dbt2looker merge',
+        description='Combine the lookml generated by "dbt2looker --shard i/N" runs into one output directory',
+    )
+    argparser.add_argument(
+        'shard_dirs',
+        help='Output directories of the shard runs',
+        nargs='+',
+        type=str,
+    )
+    argparser.add_argument(
+        '--output-dir',
+        help='Path to a directory that will contain the merged lookml files',
+        default=DEFAULT_LOOKML_OUTPUT_DIR,
+        type=str,
     )
+    add_log_level_argument(argparser)
+    args = argparser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    merged = sharding.merge_shard_outputs(args.shard_dirs, args.output_dir)
+    logging.info(f'Merged {len(merged)} lookml files from {len(args.shard_dirs)} shards into {args.output_dir}')
+    logging.info('Success')
+
+
+def add_generation_arguments(argparser: argparse.ArgumentParser):
     argparser.add_argument(
         '--project-dir',
         help='Path to dbt project directory containing dbt_project.yml. Default is "."',
@@ -73,7 +164,7 @@ def run():
     )
     argparser.add_argument(
         '--target-dir',
-        help='Path to dbt target directory containing manifest.json and catalog.json. Default is "./target"',
+        help='Path to dbt target directory containing manifest.json and catalog.json, optionally compressed with gzip, zstd or xz. Default is "./target"',
         default='./target',
         type=str,
     )
@@ -83,12 +174,17 @@ def run():
         type=str,
     )
     argparser.add_argument(
-        '--log-level',
-        help='Set level of logs. Default is INFO',
-        choices=['DEBUG', 'INFO', 'WARN', 'ERROR'],
+        '--select',
+        help='Only generate lookml for these dbt models (names or unique ids). Reads only the selected nodes from the manifest and catalog using a cached byte-offset index',
+        nargs='+',
         type=str,
-        default='INFO',
     )
+    argparser.add_argument(
+        '--shard',
+        help='Only generate lookml for shard i of N, e.g. 2/4. Models are assigned to shards by a stable hash of their unique id. Combine shard outputs with "dbt2looker merge"',
+        type=shard_type,
+    )
+    add_log_level_argument(argparser)
     argparser.add_argument(
         '--output-dir',
         help='Path to a directory that will contain the generated lookml files',
@@ -100,44 +196,357 @@ def run():
         help='DB Connection Name for generated model files',
         type=str,
     )
-    args = argparser.parse_args()
-    logging.basicConfig(
-        level=getattr(logging, args.log_level),
-        format='%(asctime)s %(levelname)-6s %(message)s',
-        datefmt='%H:%M:%S',
+    argparser.add_argument(
+        '--datagroups',
+        help='Add a datagroup to each explore from run_results.json, triggered when dbt rebuilds a model used by the explore ("model") or any model with the first tag of the explore\'s model ("tag")',
+        choices=['model', 'tag'],
+        type=str,
     )
 
+
+def load_project(args: argparse.Namespace) -> api.Project:
     # Load raw manifest file
-    raw_manifest = get_manifest(prefix=args.target_dir)
-    raw_catalog = get_catalog(prefix=args.target_dir)
-    raw_config = get_dbt_project_config(prefix=args.project_dir)
+    with metrics.stage('load_artifacts'):
+        if args.select:
+            # The subset also holds the models referenced by relationships
+            # tests of the selected models, which need catalog entries too
+            unique_ids, raw_manifest = get_selected_manifest(prefix=args.target_dir, select=args.select)
+            raw_catalog = get_catalog(prefix=args.target_dir, unique_ids=list(raw_manifest['nodes']))
+        else:
+            unique_ids = None
+            raw_manifest = get_manifest(prefix=args.target_dir)
+            raw_catalog = get_catalog(prefix=args.target_dir)
+        raw_config = get_dbt_project_config(prefix=args.project_dir)
+        raw_run_results = get_run_results(prefix=args.target_dir) if args.datagroups else None
+        raw_build_times = output.load_build_times(args.output_dir) if args.datagroups else None
 
-    # Get dbt models from manifest
     dbt_project_config = parser.parse_dbt_project_config(raw_config)
-    typed_dbt_models = parser.parse_typed_models(raw_manifest, raw_catalog, tag=args.tag)
-    adapter_type = parser.parse_adapter_type(raw_manifest)
+    connection_name = args.model_connection or dbt_project_config.name
+    return api.parse_project(
+        raw_manifest,
+        raw_catalog,
+        connection_name,
+        tag=args.tag,
+        shard=args.shard,
+        raw_run_results=raw_run_results,
+        datagroups=args.datagroups,
+        unique_ids=unique_ids,
+        previous_build_times=models.DbtBuildTimes(**raw_build_times) if raw_build_times else None,
+    )
 
-    # Generate lookml views
-    lookml_views = [
-        generator.lookml_view_from_dbt_model(model, adapter_type)
-        for model in typed_dbt_models
+
+def get_datagroup_build_times(project: api.Project, model: models.DbtModel):
+    # Build times the datagroup of a model may depend on, so that plan
+    # re-renders a model when a relation joined in its explore is rebuilt
+    if not project.datagroups:
+        return None
+    view_names = [
+        model.config.meta.view_name or model.name,
+        *(join.join for join in model.config.meta.joins),
+        *(relationship.parent_view_name for relationship in project.relationships.get(model.unique_id, [])),
     ]
-    pathlib.Path(os.path.join(args.output_dir, 'views')).mkdir(parents=True, exist_ok=True)
-    for view in lookml_views:
-        with open(os.path.join(args.output_dir, 'views', view.filename), 'w') as f:
-            f.write(view.contents)
+    return {
+        'datagroups': project.datagroups,
+        'views': {name: project.build_times.views.get(name) for name in view_names},
+        'tags': {tag: project.build_times.tags.get(tag) for tag in model.tags[:1]},
+    }
 
-    logging.info(f'Generated {len(lookml_views)} lookml views in {os.path.join(args.output_dir, "views")}')
 
-    # Generate Lookml models
-    connection_name = args.model_connection or dbt_project_config.name
-    lookml_models = [
-        generator.lookml_model_from_dbt_model(model, connection_name)
-        for model in typed_dbt_models
+def get_model_fingerprints(project: api.Project):
+    dbt2looker_version = get_version()
+    return {
+        model.unique_id: output.input_fingerprint(
+            project.raw_manifest['nodes'][model.unique_id],
+            project.raw_catalog['nodes'].get(model.unique_id),
+            project.relationships.get(model.unique_id),
+            get_datagroup_build_times(project, model),
+            project.adapter_type,
+            project.connection_name,
+            dbt2looker_version,
+        )
+        for model in project.typed_dbt_models
+    }
+
+
+def get_output_files(typed_dbt_models, view_dicts, model_dicts, fingerprints):
+    lookml_views = [generator.lookml_view_file(view) for view in view_dicts]
+    lookml_models = [generator.lookml_model_file(model) for model in model_dicts]
+    return [
+        output.OutputFile(
+            path=os.path.join('views', view.filename),
+            contents=view.contents,
+            unique_id=model.unique_id,
+            fingerprint=fingerprints[model.unique_id],
+        )
+        for view, model in zip(lookml_views, typed_dbt_models)
+    ] + [
+        output.OutputFile(
+            path=lookml_model.filename,
+            contents=lookml_model.contents,
+            unique_id=model.unique_id,
+            fingerprint=fingerprints[model.unique_id],
+        )
+        for lookml_model, model in zip(lookml_models, typed_dbt_models)
     ]
-    for model in lookml_models:
-        with open(os.path.join(args.output_dir, model.filename), 'w') as f:
-            f.write(model.contents)
-    
-    logging.info(f'Generated {len(lookml_models)} lookml models in {args.output_dir}')
+
+
+def get_output_index_path(output_dir: str, output_index: Optional[str]):
+    if output_index == OUTPUT_INDEX_IN_OUTPUT_DIR:
+        return os.path.join(output_dir, output.DEFAULT_OUTPUT_INDEX_FILENAME)
+    return output_index
+
+
+def run_plan(argv: List[str]):
+    argparser = argparse.ArgumentParser(
+        prog='dbt2looker plan',
+        description='Report which lookml files would be added, modified or deleted, without writing any files',
+    )
+    add_generation_arguments(argparser)
+    argparser.add_argument(
+        '--state',
+        help=f'Output index of a previous run written with --output-index. Models whose inputs did not change since are not rendered. Default is {output.DEFAULT_OUTPUT_INDEX_FILENAME} in the output directory',
+        type=str,
+    )
+    argparser.add_argument(
+        '--json',
+        help='Print the plan as JSON',
+        action='store_true',
+    )
+    argparser.add_argument(
+        '--no-diff',
+        help='Do not print diffs of modified files',
+        action='store_true',
+    )
+    argparser.add_argument(
+        '--detailed-exitcode',
+        help='Exit with code 2 if there are changes, 0 otherwise',
+        action='store_true',
+    )
+    args = argparser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    project = load_project(args)
+    fingerprints = get_model_fingerprints(project)
+
+    def render(changed_models):
+        view_dicts = api.get_view_dicts(project, changed_models)
+        model_dicts = api.get_model_dicts(project, changed_models)
+        return get_output_files(changed_models, view_dicts, model_dicts, fingerprints)
+
+    state_path = args.state or get_output_index_path(args.output_dir, OUTPUT_INDEX_IN_OUTPUT_DIR)
+    changes = plan.plan_changes(
+        args.output_dir,
+        project.typed_dbt_models,
+        fingerprints,
+        render,
+        previous_index=output.load_output_index(state_path),
+        detect_deleted=not (args.select or args.shard or args.tag),
+    )
+    if args.json:
+        print(json.dumps(changes, indent=2))
+    else:
+        print(plan.format_plan(changes, show_diff=not args.no_diff))
+    if args.detailed_exitcode and (changes['add'] or changes['modify'] or changes['delete']):
+        raise SystemExit(2)
+
+
+def build_generate_argparser():
+    argparser = argparse.ArgumentParser(
+        epilog='Other commands: "dbt2looker merge --help", "dbt2looker plan --help", "dbt2looker batch --help", "dbt2looker serve --help"',
+    )
+    argparser.add_argument(
+        '--version',
+        action='version',
+        version=f'dbt2looker {get_version()}',
+    )
+    add_generation_arguments(argparser)
+    argparser.add_argument(
+        '--output-index',
+        help=f'Write a JSON index of the generated files with their content hash, source model and new/changed/unchanged/deleted status. Defaults to {output.DEFAULT_OUTPUT_INDEX_FILENAME} in the output directory if no path is given',
+        nargs='?',
+        const=OUTPUT_INDEX_IN_OUTPUT_DIR,
+        type=str,
+    )
+    argparser.add_argument(
+        '--metrics-file',
+        help='Write run duration, stage durations, model and file counts and peak memory to this path in OpenMetrics text format, e.g. for the node exporter textfile collector',
+        type=str,
+    )
+    argparser.add_argument(
+        '--fail-on-invalid-references',
+        help='Exit with an error instead of a warning when a generated measure, set or join references a field that was not generated',
+        action='store_true',
+    )
+    return argparser
+
+
+def generate(args: argparse.Namespace):
+    run_metrics = metrics.start_run()
+    project = load_project(args)
+    typed_dbt_models = project.typed_dbt_models
+
+    with metrics.stage('generate'):
+        # Generate lookml views
+        view_dicts = api.get_view_dicts(project, typed_dbt_models)
+
+        # Generate Lookml models
+        model_dicts = api.get_model_dicts(project, typed_dbt_models)
+
+    # Validate field references before writing any files
+    with metrics.stage('validate'):
+        validation_errors = validator.validate_lookml(view_dicts, model_dicts)
+    for error in validation_errors:
+        logging.warning(error)
+    if validation_errors and args.fail_on_invalid_references:
+        logging.error(f'Found {len(validation_errors)} invalid field references')
+        raise SystemExit('Failed')
+
+    with metrics.stage('render'):
+        fingerprints = get_model_fingerprints(project)
+        output_files = get_output_files(typed_dbt_models, view_dicts, model_dicts, fingerprints)
+    with metrics.stage('write'):
+        output_index_path = get_output_index_path(args.output_dir, args.output_index)
+        previous_index = output.load_output_index(output_index_path) if output_index_path else None
+        pathlib.Path(os.path.join(args.output_dir, 'views')).mkdir(parents=True, exist_ok=True)
+        records = output.write_lookml_files(args.output_dir, output_files, previous_index)
+        if project.build_times is not None:
+            output.write_build_times(args.output_dir, {'views': project.build_times.views, 'tags': project.build_times.tags})
+
+    logging.info(f'Generated {len(view_dicts)} lookml views in {os.path.join(args.output_dir, "views")}')
+    logging.info(f'Generated {len(model_dicts)} lookml models in {args.output_dir}')
+
+    if output_index_path:
+        # Only a run over all models can tell which previously generated files
+        # are gone, filtered runs keep the records of the files they did not generate
+        if args.select or args.shard or args.tag:
+            index_records = records + output.carried_over_records(records, previous_index)
+        else:
+            records += output.delete_stale_files(args.output_dir, records, previous_index)
+            index_records = records
+        output.write_output_index(output_index_path, index_records)
+    summary = output.summarise_records(records)
+    if output_index_path:
+        logging.info(
+            f'Wrote output index to {output_index_path}: '
+            f'{summary["new"]} new, {summary["changed"]} changed, {summary["unchanged"]} unchanged, {summary["deleted"]} deleted'
+        )
+    if args.metrics_file:
+        for status in ('new', 'changed', 'unchanged'):
+            metrics.count('dbt2looker_files', summary[status], status=status)
+        metrics.write_openmetrics(args.metrics_file, run_metrics)
+    return {
+        'views': len(view_dicts),
+        'models': len(model_dicts),
+        **summary,
+    }
+
+
+def run_serve(argv: List[str]):
+    argparser = argparse.ArgumentParser(
+        prog='dbt2looker serve',
+        description='Serve lookml for single models over localhost http or a unix socket, keeping the parsed dbt artifacts in memory. '
+                    'Endpoints: GET /views/<name>, /explores/<name>, /models?tag=<tag>, /health',
+    )
+    add_generation_arguments(argparser)
+    argparser.add_argument(
+        '--host',
+        help='Host to listen on. Default is 127.0.0.1',
+        default='127.0.0.1',
+        type=str,
+    )
+    argparser.add_argument(
+        '--port',
+        help='Port to listen on. Default is 8000',
+        default=8000,
+        type=int,
+    )
+    argparser.add_argument(
+        '--socket',
+        help='Listen on this unix socket instead of a tcp port',
+        type=str,
+    )
+    args = argparser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    state = server.ProjectState(args, load_project)
+    state.refresh()
+    server.serve(state, host=args.host, port=args.port, socket_path=args.socket)
+
+
+def run_generate(argv: Optional[List[str]] = None):
+    args = build_generate_argparser().parse_args(argv)
+    configure_logging(args.log_level)
+    generate(args)
+    logging.info('Success')
+
+
+def run_batch(argv: List[str]):
+    argparser = argparse.ArgumentParser(
+        prog='dbt2looker batch',
+        description='Generate lookml for several dbt projects in one process',
+    )
+    argparser.add_argument(
+        'config',
+        help='Path to a yaml file listing the projects to generate, see the README for the format',
+        type=str,
+    )
+    argparser.add_argument(
+        '--jobs',
+        help='Number of projects to generate concurrently. Threads only overlap reading and writing files, use --processes to generate on several cores. Overrides "jobs" in the config file. Default is 1',
+        type=int,
+    )
+    argparser.add_argument(
+        '--processes',
+        help='Run jobs in worker processes instead of threads. Caches are then not shared between projects',
+        action='store_true',
+    )
+    argparser.add_argument(
+        '--report',
+        help='Write the summary and timings of all projects as JSON to this path',
+        type=str,
+    )
+    add_log_level_argument(argparser)
+    args = argparser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    try:
+        with open(args.config, 'r') as f:
+            raw_batch_config = yaml.load(f, Loader=Loader)
+    except FileNotFoundError as e:
+        logging.error(f'Could not find batch config file at {args.config}')
+        raise SystemExit('Failed')
+    batch_config = batch.parse_batch_config(raw_batch_config, os.path.dirname(args.config))
+    generate_argparser = build_generate_argparser()
+    projects = [
+        (name, generate_argparser.parse_args(project_argv + ['--log-level', args.log_level]))
+        for name, project_argv in batch_config.projects
+    ]
+    results = batch.run_projects(
+        projects,
+        generate,
+        jobs=args.jobs or batch_config.jobs,
+        processes=args.processes or batch_config.processes,
+    )
+    for line in batch.format_report(results):
+        logging.info(line)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+    if any(result['status'] != 'success' for result in results):
+        raise SystemExit('Failed')
     logging.info('Success')
+
+
+COMMANDS = {
+    'merge': run_merge,
+    'plan': run_plan,
+    'batch': run_batch,
+    'serve': run_serve,
+}
+
+
+def run():
+    argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    return run_generate(argv)
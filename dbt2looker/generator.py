@@ -1,8 +1,11 @@
+import functools
 import logging
 import re
+from typing import List, Optional
 
 import lkml
 
+from . import metrics
 from . import models
 
 LOOKER_DTYPE_MAP = {
@@ -203,18 +206,35 @@ def normalise_spark_types(column_type: str) -> str:
 
 # A dimension/measure description will start indented at 4 spaces, so subsequent
 # lines should start indented at 4 + 2 spaces.
+# Descriptions are often shared docs blocks, so indented copies are memoized.
+@functools.lru_cache(maxsize=16384)
 def indent_multiline_description(description: str, space_count = 6) -> str:
     return description.replace('\n', '\n' + ' ' * space_count)
 
 
-def map_adapter_type_to_looker(adapter_type: models.SupportedDbtAdapters, column_type: str):
+# Column types repeat across models and projects, so lookups are cached for
+# the lifetime of the process
+@functools.lru_cache(maxsize=None)
+def lookup_looker_type(adapter_type: models.SupportedDbtAdapters, column_type: str):
     normalised_column_type = (normalise_spark_types(column_type) if adapter_type == models.SupportedDbtAdapters.spark.value else column_type).upper()
-    looker_type = LOOKER_DTYPE_MAP[adapter_type].get(normalised_column_type)
+    return LOOKER_DTYPE_MAP[adapter_type].get(normalised_column_type)
+
+
+def map_adapter_type_to_looker(adapter_type: models.SupportedDbtAdapters, column_type: str):
+    looker_type = lookup_looker_type(adapter_type, column_type)
     if (column_type is not None) and (looker_type is None):
         logging.warning(f'Column type {column_type} not supported for conversion from {adapter_type} to looker. No dimension will be created.')
     return looker_type
 
 
+def count_unsupported_columns(dbt_models: List[models.DbtModel], adapter_type: models.SupportedDbtAdapters):
+    # Counted once per column, map_adapter_type_to_looker is called several times per column
+    for model in dbt_models:
+        for column in model.columns.values():
+            if column.data_type is not None and lookup_looker_type(adapter_type, column.data_type) is None:
+                metrics.count('dbt2looker_unsupported_columns', adapter_type=adapter_type, column_type=column.data_type)
+
+
 def lookml_date_time_dimension_group(column: models.DbtModelColumn, adapter_type: models.SupportedDbtAdapters):
     description = column.meta.dimension.description or column.description
     return {
@@ -366,20 +386,8 @@ def lookml_dimensions_from_model(model: models.DbtModel, adapter_type: models.Su
 
 
 def lookml_measure_filters(measure: models.Dbt2LookerMeasure, model: models.DbtModel):
-    # This check is (temporarily) disabled as it cannot handle the case when a filter
-    # references a dimension defined as a derived dimension, not a column
-    
-    # try:
-    #     columns = {
-    #         column_name: model.columns[column_name]
-    #         for f in measure.filters
-    #         for column_name in f
-    #     }
-    # except KeyError as e:
-    #     raise ValueError(
-    #         f'Model {model.unique_id} contains a measure that references a non_existent column: {e}\n'
-    #         f'Ensure that dbt model {model.unique_id} contains a column: {e}'
-    #     ) from e
+    # Filter references are checked once all views are generated, see
+    # validator.validate_lookml, as they may reference derived dimensions
     return [{
         (column_name): fexpr
         for column_name, fexpr in f.items()
@@ -445,7 +453,7 @@ def lookml_set_of_dimensions(dimensions, dimension_groups):
     }
 
 
-def lookml_view_from_dbt_model(model: models.DbtModel, adapter_type: models.SupportedDbtAdapters):
+def lookml_view_dict_from_dbt_model(model: models.DbtModel, adapter_type: models.SupportedDbtAdapters):
     view_name = model.config.meta.view_name or model.name
 
     dimensions = lookml_dimensions_from_model(model, adapter_type)
@@ -468,12 +476,172 @@ def lookml_view_from_dbt_model(model: models.DbtModel, adapter_type: models.Supp
         len(lookml['view']['measures']),
         len(lookml['view']['dimensions']),
     )
+    return lookml
+
+
+def lookml_view_file(lookml: dict):
     contents = lkml.dump(lookml)
-    filename = f'{view_name}.view.lkml'
+    filename = f'{lookml["view"]["name"]}.view.lkml'
     return models.LookViewFile(filename=filename, contents=contents)
 
 
-def lookml_model_from_dbt_model(model: models.DbtModel, connection_name: str):
+def lookml_view_from_dbt_model(model: models.DbtModel, adapter_type: models.SupportedDbtAdapters):
+    return lookml_view_file(lookml_view_dict_from_dbt_model(model, adapter_type))
+
+
+def lookml_explore_join(join: models.Dbt2LookerExploreJoin):
+    lookml = {
+        'name': join.join,
+        'type': join.type.value,
+        'relationship': join.relationship.value,
+        'sql_on': join.sql_on,
+        'foreign_key': join.foreign_key,
+        'view_label': join.view_label,
+    }
+    return {key: value for key, value in lookml.items() if value is not None}
+
+
+def lookml_join_field(column: models.DbtModelColumn, adapter_type: models.SupportedDbtAdapters):
+    # Joins compare exact values, time columns are joined on their raw timeframe
+    if column.data_type is None:
+        return None
+    field, is_time = lookml_column_field(column, adapter_type)
+    if not is_time:
+        return field
+    if 'raw' not in (column.meta.dimension.timeframes or looker_timeframes):
+        return None
+    return f'{column.meta.dimension.name or column.name}_raw'
+
+
+def lookml_inferred_joins(model: models.DbtModel, view_name: str, relationships: List[models.DbtRelationship], adapter_type: models.SupportedDbtAdapters):
+    # Joins written in meta take precedence over joins inferred from tests
+    join_names = {view_name, *(join.join for join in model.config.meta.joins)}
+    explicit_views = {join.join for join in model.config.meta.joins}
+    joins = []
+    for relationship in relationships:
+        column = model.columns.get(relationship.column_name)
+        if column is None or relationship.parent_view_name in explicit_views:
+            continue
+        # Disabled dimensions and time columns without a raw timeframe have no field to join on
+        field = lookml_join_field(column, adapter_type)
+        parent_field = lookml_join_field(relationship.parent_column, adapter_type)
+        if field is None or parent_field is None:
+            continue
+        join_name = relationship.parent_view_name
+        if join_name in join_names:
+            # Several columns reference the same model, or the model references itself
+            join_name = f'{relationship.parent_view_name}_{relationship.column_name}'
+            if join_name in join_names:
+                continue
+        join_names.add(join_name)
+        joins.append({
+            'name': join_name,
+            **(
+                {'from': relationship.parent_view_name}
+                if join_name != relationship.parent_view_name
+                else {}
+            ),
+            'type': models.LookerJoinType.left_outer.value,
+            'relationship': models.LookerJoinRelationship.many_to_one.value,
+            'sql_on': f'${{{view_name}.{field}}} = ${{{join_name}.{parent_field}}}',
+        })
+    return joins
+
+
+def lookml_qualified_field(view_name: str, field: str):
+    # Fields of joined views are written as view.field
+    return field if '.' in field else f'{view_name}.{field}'
+
+
+def lookml_aggregate_table(aggregate_table: models.Dbt2LookerAggregateTable, view_name: str):
+    # Field references are checked against the generated views by
+    # validator.validate_lookml
+    dimensions = [
+        *aggregate_table.dimensions,
+        *(
+            f'{dimension_group}_{timeframe}'
+            for dimension_group, timeframes in aggregate_table.timeframes.items()
+            for timeframe in timeframes
+        ),
+    ]
+    query = {
+        'dimensions': [lookml_qualified_field(view_name, field) for field in dimensions],
+        'measures': [lookml_qualified_field(view_name, field) for field in aggregate_table.measures],
+        'filters': [
+            {lookml_qualified_field(view_name, field): fexpr for field, fexpr in f.items()}
+            for f in aggregate_table.filters
+        ],
+        'timezone': aggregate_table.timezone,
+    }
+    materialization = {
+        key: str(getattr(aggregate_table.materialization, key))
+        for key in ('datagroup_trigger', 'sql_trigger_value', 'persist_for', 'increment_key', 'increment_offset')
+        if getattr(aggregate_table.materialization, key) is not None
+    }
+    return {
+        'name': aggregate_table.name,
+        'query': {key: value for key, value in query.items() if value},
+        'materialization': materialization,
+    }
+
+
+def lookml_column_field(column: models.DbtModelColumn, adapter_type: models.SupportedDbtAdapters):
+    # Name of the field generated for a column, see lookml_dimension_groups_from_model
+    # and lookml_dimensions_from_model, and whether it is a time field
+    name = column.meta.dimension.name or column.name
+    # Unsupported types were already reported when generating the view
+    looker_type = lookup_looker_type(adapter_type, column.data_type)
+    if looker_type in looker_date_time_types or (looker_type in looker_date_types and column.meta.dimension.enabled):
+        timeframes = column.meta.dimension.timeframes or looker_timeframes
+        return f'{name}_{"date" if "date" in timeframes else timeframes[0]}', True
+    if looker_type in looker_scalar_types and column.meta.dimension.enabled:
+        return name, False
+    return None, False
+
+
+def lookml_column_filter_field(model: models.DbtModel, column_name: str, adapter_type: models.SupportedDbtAdapters):
+    column = model.columns.get(column_name)
+    if column is None:
+        return None, False
+    return lookml_column_field(column, adapter_type)
+
+
+def lookml_partition_filters(model: models.DbtModel, view_name: str, adapter_type: models.SupportedDbtAdapters):
+    # Partitioned tables always need a partition filter, unless a cluster
+    # column is filtered, which also limits the blocks scanned. Tables with
+    # require_partition_filter reject queries without a partition filter.
+    if not (model.config.partition_by and model.config.meta.partition_filter):
+        return {}
+    filters = []
+    for partition in model.config.partition_by:
+        field, is_time = lookml_column_filter_field(model, partition.field, adapter_type)
+        if field is None:
+            continue
+        # Integer and string partitions have no sensible default, users have to pick a value
+        default = model.config.meta.partition_filter_default
+        filters.append({f'{view_name}.{field}': default if default is not None else ('30 days' if is_time else '')})
+    unless = [
+        f'{view_name}.{field}'
+        for field, _ in (
+            lookml_column_filter_field(model, column_name, adapter_type)
+            for column_name in model.config.cluster_by or []
+        )
+        if field is not None
+    ]
+    if not filters:
+        logging.warning(f'Partition columns of model {model.unique_id} have no looker fields. No partition filter will be required.')
+        return {}
+    if unless and not model.config.require_partition_filter:
+        return {'conditionally_filter': {'filters': filters, 'unless': unless}}
+    return {'always_filter': {'filters': filters}}
+
+
+def lookml_model_dict_from_dbt_model(
+    model: models.DbtModel,
+    connection_name: str,
+    relationships: Optional[List[models.DbtRelationship]] = None,
+    adapter_type: Optional[models.SupportedDbtAdapters] = None,
+):
     # Note: assumes view names = model names
     #       and models are unique across dbt packages in project
     view_name = model.config.meta.view_name or model.name
@@ -497,17 +665,69 @@ def lookml_model_from_dbt_model(model: models.DbtModel, connection_name: str):
     if model.description:
         lookml['explore']['description'] = indent_multiline_description(model.description, 4)
     lookml['explore']['joins'] = [
-        {
-            'name': join.join,
-            'type': join.type.value,
-            'relationship': join.relationship.value,
-            'sql_on': join.sql_on,
-            'foreign_key': join.foreig_key,
-            'view_label': join.view_label,
-        }
+        lookml_explore_join(join)
         for join in model.config.meta.joins
     ]
+    if relationships and adapter_type is not None and model.config.meta.infer_joins:
+        lookml['explore']['joins'] += lookml_inferred_joins(model, view_name, relationships, adapter_type)
+    if adapter_type is not None:
+        lookml['explore'].update(lookml_partition_filters(model, view_name, adapter_type))
+    if model.config.meta.aggregate_tables:
+        lookml['explore']['aggregate_tables'] = [
+            lookml_aggregate_table(aggregate_table, view_name)
+            for aggregate_table in model.config.meta.aggregate_tables
+        ]
+    return lookml
+
+
+def lookml_explore_view_names(explore: dict):
+    return [
+        explore.get('from', explore['name']),
+        *(join.get('from', join['name']) for join in explore.get('joins', [])),
+    ]
 
+
+def lookml_datagroup(model: models.DbtModel, explore: dict, build_times: models.DbtBuildTimes, datagroups: str):
+    # The trigger only changes when dbt rebuilds a relation used by the explore,
+    # so Looker keeps its cache between dbt runs
+    tag = model.tags[0] if model.tags else None
+    if datagroups == 'tag' and tag is not None:
+        name = re.sub(r'\W', '_', tag)
+        built_at = [build_times.tags.get(tag)]
+    else:
+        name = explore['name']
+        built_at = [build_times.views.get(view_name) for view_name in lookml_explore_view_names(explore)]
+    built_at = [completed_at for completed_at in built_at if completed_at is not None]
+    if not built_at:
+        logging.debug('No successful dbt build found for explore %s, no datagroup will be generated', explore['name'])
+        return None
+    return {
+        'name': f'{name}_dbt_build',
+        'sql_trigger': f"SELECT '{max(built_at)}'",
+        'description': f'Last built by dbt at {max(built_at)}',
+    }
+
+
+def lookml_persist_with_datagroup(lookml: dict, model: models.DbtModel, build_times: models.DbtBuildTimes, datagroups: str):
+    datagroup = lookml_datagroup(model, lookml['explore'], build_times, datagroups)
+    if datagroup is not None:
+        # Datagroups are written before the explore that persists with them
+        explore = lookml.pop('explore')
+        lookml['datagroups'] = [datagroup]
+        lookml['explore'] = {**explore, 'persist_with': datagroup['name']}
+    return lookml
+
+
+def lookml_model_file(lookml: dict):
     contents = lkml.dump(lookml)
-    filename = f'{view_name}.model.lkml'
+    filename = f'{lookml["explore"]["name"]}.model.lkml'
     return models.LookModelFile(filename=filename, contents=contents)
+
+
+def lookml_model_from_dbt_model(
+    model: models.DbtModel,
+    connection_name: str,
+    relationships: Optional[List[models.DbtRelationship]] = None,
+    adapter_type: Optional[models.SupportedDbtAdapters] = None,
+):
+    return lookml_model_file(lookml_model_dict_from_dbt_model(model, connection_name, relationships, adapter_type))
@@ -0,0 +1,68 @@
+from typing import Dict, List, Optional
+
+from . import models
+
+# Large projects repeat the same column types, tags, docs blocks and default
+# meta across thousands of columns. Sharing one object per distinct value
+# keeps the parsed models small, which matters for long lived processes such
+# as "dbt2looker serve" and batch runs. Values are shared through dicts owned
+# by one Interner rather than sys.intern, so they are freed together with the
+# parsed project.
+
+
+class Interner:
+    def __init__(self):
+        self.strings: Dict[str, str] = {}
+        self.lists: Dict[tuple, list] = {}
+        self.default_column_meta = models.DbtModelColumnMeta()
+
+    def string(self, value: Optional[str]) -> Optional[str]:
+        return self.strings.setdefault(value, value) if isinstance(value, str) else value
+
+    def string_list(self, values: Optional[List[str]]) -> Optional[List[str]]:
+        if values is None:
+            return None
+        key = tuple(values)
+        if key not in self.lists:
+            self.lists[key] = [self.string(value) for value in values]
+        return self.lists[key]
+
+    def dimension(self, dimension: models.Dbt2LookerDimension):
+        for field in ('name', 'sql', 'description', 'group_label', 'view_label', 'label', 'type', 'group_item_label'):
+            setattr(dimension, field, self.string(getattr(dimension, field)))
+        for field in ('timeframes', 'suggestions', 'required_access_grants'):
+            setattr(dimension, field, self.string_list(getattr(dimension, field)))
+
+    def column(self, column: models.DbtModelColumn):
+        column.name = self.string(column.name)
+        column.description = self.string(column.description)
+        column.data_type = self.string(column.data_type)
+        if column.meta == self.default_column_meta:
+            # Most columns have no meta, share a single default instead of one copy per column
+            column.meta = self.default_column_meta
+        else:
+            self.dimension(column.meta.dimension)
+            for measures in (column.meta.measures, column.meta.measure, column.meta.metrics, column.meta.metric):
+                for measure in measures.values():
+                    measure.description = self.string(measure.description)
+                    measure.group_label = self.string(measure.group_label)
+                    measure.view_label = self.string(measure.view_label)
+
+    def model(self, model: models.DbtModel):
+        model.description = self.string(model.description)
+        model.db_schema = self.string(model.db_schema)
+        model.tags = self.string_list(model.tags)
+        model.columns = {self.string(name): column for name, column in model.columns.items()}
+        for column in model.columns.values():
+            self.column(column)
+        if model.config is not None and model.config.meta is not None:
+            for dimension in model.config.meta.dimensions:
+                self.dimension(dimension)
+
+
+def intern_models(dbt_models: List[models.DbtModel]) -> List[models.DbtModel]:
+    """Deduplicate repeated strings, tag lists and default meta across models, in place"""
+    interner = Interner()
+    for model in dbt_models:
+        interner.model(model)
+    return dbt_models
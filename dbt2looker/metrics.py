@@ -0,0 +1,118 @@
+import collections
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Optional, Tuple
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The collector of the run in progress, per thread so that batch runs in
+# parallel threads do not mix their metrics
+_active = threading.local()
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.stage_seconds = collections.OrderedDict()
+        self.values = collections.Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0) + time.perf_counter() - started
+
+    def duration(self) -> float:
+        return time.time() - self.started
+
+
+def start_run() -> RunMetrics:
+    _active.metrics = RunMetrics()
+    return _active.metrics
+
+
+def active() -> Optional[RunMetrics]:
+    return getattr(_active, 'metrics', None)
+
+
+def stage(name: str):
+    """Time a stage of the active run, if metrics are being collected"""
+    metrics = active()
+    return metrics.stage(name) if metrics is not None else contextlib.nullcontext()
+
+
+def count(name: str, value: int = 1, **labels):
+    metrics = active()
+    if metrics is not None:
+        metrics.values[(name, tuple(sorted(labels.items())))] += value
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name: str, labels: Tuple[Tuple[str, str], ...], value) -> str:
+    label_string = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+    return f'{name}{{{label_string}}} {value}' if label_string else f'{name} {value}'
+
+
+HELP = {
+    'dbt2looker_run_duration_seconds': 'Duration of the dbt2looker run',
+    'dbt2looker_run_timestamp_seconds': 'Time the dbt2looker run started',
+    'dbt2looker_stage_duration_seconds': 'Duration of each stage of the dbt2looker run',
+    'dbt2looker_peak_rss_bytes': 'Peak resident set size of the dbt2looker process',
+    'dbt2looker_models_selected': 'dbt models selected for generation',
+    'dbt2looker_models_skipped': 'dbt models not selected, e.g. ephemeral or filtered by tag',
+    'dbt2looker_models_missing_from_catalog': 'Selected dbt models without a catalog entry',
+    'dbt2looker_unsupported_columns': 'Columns of a type that cannot be mapped to a looker type, by column type',
+    'dbt2looker_files': 'Generated lookml files by status',
+}
+
+
+def format_openmetrics(metrics: RunMetrics) -> str:
+    samples = collections.OrderedDict()
+    samples['dbt2looker_run_duration_seconds'] = [((), round(metrics.duration(), 6))]
+    samples['dbt2looker_run_timestamp_seconds'] = [((), round(metrics.started, 3))]
+    samples['dbt2looker_stage_duration_seconds'] = [
+        ((('stage', name),), round(seconds, 6))
+        for name, seconds in metrics.stage_seconds.items()
+    ]
+    rss = peak_rss_bytes()
+    if rss is not None:
+        samples['dbt2looker_peak_rss_bytes'] = [((), rss)]
+    for (name, labels), value in sorted(metrics.values.items()):
+        samples.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, values in samples.items():
+        lines.append(f'# TYPE {name} gauge')
+        if name in HELP:
+            lines.append(f'# HELP {name} {HELP[name]}')
+        lines += [_sample(name, labels, value) for labels, value in values]
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_openmetrics(path: str, metrics: RunMetrics):
+    # Write atomically so that the node exporter never reads a partial file
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as f:
+        f.write(format_openmetrics(metrics))
+    os.replace(temporary_path, path)
+    logging.debug('Wrote run metrics to %s', path)
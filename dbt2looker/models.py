@@ -179,20 +179,93 @@ class Dbt2LookerExploreJoin(BaseModel):
     view_label: Optional[str] = None
 
 
+class Dbt2LookerAggregateTableMaterialization(BaseModel):
+    datagroup_trigger: Optional[str] = None
+    sql_trigger_value: Optional[str] = None
+    persist_for: Optional[str] = None
+    increment_key: Optional[str] = None
+    increment_offset: Optional[int] = None
+
+
+class Dbt2LookerAggregateTable(BaseModel):
+    name: str
+    # Field names of the explore's view, or view.field for joined views
+    dimensions: Optional[List[str]] = []
+    # Dimension group name to timeframes, e.g. {created_at: [date, month]}
+    timeframes: Optional[Dict[str, List[str]]] = {}
+    measures: Optional[List[str]] = []
+    filters: Optional[List[Dict[str, str]]] = []
+    timezone: Optional[str] = None
+    materialization: Dbt2LookerAggregateTableMaterialization
+
+    @validator('filters')
+    def filters_are_singular_dicts(cls, v: List[Dict[str, str]]):
+        if v is not None:
+            for f in v:
+                if len(f) != 1:
+                    raise ValueError('Multiple filter names provided for a single filter in aggregate table')
+        return v
+
+    @validator('materialization')
+    def materialization_is_persisted(cls, v: Dbt2LookerAggregateTableMaterialization):
+        if not (v.datagroup_trigger or v.sql_trigger_value or v.persist_for):
+            raise ValueError('Aggregate table materialization needs one of datagroup_trigger, sql_trigger_value or persist_for')
+        return v
+
+
 class Dbt2LookerModelMeta(BaseModel):
     joins: Optional[List[Dbt2LookerExploreJoin]] = []
+    # Rollups Looker can answer explore queries from, see aggregate awareness
+    aggregate_tables: Optional[List[Dbt2LookerAggregateTable]] = []
+    # Generate joins from dbt relationships tests, joins above take precedence
+    infer_joins: Optional[bool] = True
     view_name: Optional[str] = None
     label: Optional[str] = None
     view_label: Optional[str] = None
     group_label: Optional[str] = None
     dimensions: Optional[List[Dbt2LookerDimension]] = []
+    # Require a filter on the partition column in explores of partitioned models
+    partition_filter: Optional[bool] = True
+    # Default filter value, "30 days" for time partitions and any value otherwise
+    partition_filter_default: Optional[str] = None
 
 
 class DbtModelMeta(Dbt2LookerModelMeta):
     pass
 
+class DbtModelPartitionBy(BaseModel):
+    field: str
+    # Only set for BigQuery, Spark partition_by is a list of column names
+    data_type: Optional[str] = None
+    granularity: Optional[str] = None
+
+
 class DbtModelConfig(BaseModel):
     meta: Optional[DbtModelMeta]
+    partition_by: Optional[List[DbtModelPartitionBy]] = None
+    cluster_by: Optional[List[str]] = None
+    # BigQuery rejects queries without a partition filter when set
+    require_partition_filter: Optional[bool] = None
+
+    @validator('partition_by', pre=True)
+    def partition_by_is_list(cls, v):
+        if v is None:
+            return v
+        partitions = [v] if isinstance(v, (str, dict)) else v
+        return [{'field': p} if isinstance(p, str) else p for p in partitions]
+
+    @validator('partition_by')
+    def case_insensitive_partition_fields(cls, v: Optional[List[DbtModelPartitionBy]]):
+        if v is None:
+            return v
+        return [p.copy(update={'field': p.field.lower()}) for p in v]
+
+    @validator('cluster_by', pre=True)
+    def cluster_by_is_list(cls, v):
+        if v is None:
+            return v
+        return [c.lower() for c in ([v] if isinstance(v, str) else v)]
+
 
 class DbtModel(DbtNode):
     resource_type: Literal['model']
@@ -212,6 +285,22 @@ class DbtModel(DbtNode):
         }
 
 
+class DbtRelationship(BaseModel):
+    # From a dbt relationships test: child.column_name references parent.field
+    child_unique_id: str
+    column_name: str
+    parent_unique_id: str
+    parent_view_name: str
+    # The parent field, typed from the catalog
+    parent_column: DbtModelColumn
+
+
+class DbtBuildTimes(BaseModel):
+    # When dbt last built each relation successfully, from run_results.json
+    views: Dict[str, str] = {}
+    tags: Dict[str, str] = {}
+
+
 class DbtManifestMetadata(BaseModel):
     adapter_type: str
 
@@ -0,0 +1,164 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pathlib
+from typing import Dict, List, NamedTuple, Optional
+
+OUTPUT_INDEX_VERSION = 1
+DEFAULT_OUTPUT_INDEX_FILENAME = 'dbt2looker_index.json'
+# Build times of earlier dbt runs, kept for datagroups of models a partial run did not build
+BUILD_TIMES_FILENAME = 'dbt2looker_build_times.json'
+
+
+class OutputFile(NamedTuple):
+    # Path relative to the output directory, e.g. views/pages.view.lkml
+    path: str
+    contents: str
+    unique_id: str
+    # Hash of everything the file was generated from, see input_fingerprint
+    fingerprint: Optional[str] = None
+
+
+def content_hash(contents: str) -> str:
+    return hashlib.sha256(contents.encode('utf-8')).hexdigest()
+
+
+def input_fingerprint(*inputs) -> str:
+    """Stable hash of json serialisable generation inputs, e.g. the raw manifest and catalog nodes of a model"""
+    serialised = json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialised.encode('utf-8')).hexdigest()
+
+
+def file_hash(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def utc_now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+
+def write_lookml_files(output_dir: str, files: List[OutputFile], previous_index: Optional[dict] = None) -> List[dict]:
+    """Write generated lookml files, leaving files with unchanged contents untouched
+
+    Returns one output index record per file.
+    """
+    previous_records = {record['path']: record for record in (previous_index or {}).get('files', [])}
+    generated_at = utc_now()
+    records = []
+    for output_file in files:
+        path = os.path.join(output_dir, output_file.path)
+        sha256 = content_hash(output_file.contents)
+        existing_sha256 = file_hash(path)
+        if existing_sha256 == sha256:
+            status = 'unchanged'
+            file_generated_at = previous_records.get(output_file.path, {}).get('generated_at', generated_at)
+        else:
+            status = 'new' if existing_sha256 is None else 'changed'
+            file_generated_at = generated_at
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(output_file.contents)
+        records.append({
+            'path': output_file.path,
+            'sha256': sha256,
+            'unique_id': output_file.unique_id,
+            'fingerprint': output_file.fingerprint,
+            'status': status,
+            'generated_at': file_generated_at,
+        })
+    logging.debug(
+        'Wrote %d lookml files, %d unchanged',
+        sum(record['status'] != 'unchanged' for record in records),
+        sum(record['status'] == 'unchanged' for record in records),
+    )
+    return records
+
+
+def is_stale_file(output_dir: str, record: dict) -> bool:
+    """Whether the file of a previous index record can be deleted
+
+    Only files inside the output directory that still have the contents
+    dbt2looker wrote are deleted, files edited since are left alone.
+    """
+    path = os.path.normpath(record['path'])
+    if os.path.isabs(path) or path.split(os.sep)[0] == os.pardir:
+        return False
+    return file_hash(os.path.join(output_dir, path)) == record['sha256']
+
+
+def delete_stale_files(output_dir: str, records: List[dict], previous_index: Optional[dict]) -> List[dict]:
+    """Delete the files of the previous index that were not generated this time
+
+    Returns records of the deleted files.
+    """
+    generated_paths = {record['path'] for record in records}
+    deleted = []
+    for record in (previous_index or {}).get('files', []):
+        if record['path'] in generated_paths or record['status'] == 'deleted':
+            continue
+        if not is_stale_file(output_dir, record):
+            logging.warning(f'Not deleting {record["path"]}, it was edited or removed since it was generated')
+            continue
+        os.remove(os.path.join(output_dir, record['path']))
+        deleted.append({**record, 'status': 'deleted'})
+    logging.debug('Deleted %d lookml files', len(deleted))
+    return deleted
+
+
+def carried_over_records(records: List[dict], previous_index: Optional[dict]) -> List[dict]:
+    """Records of the previous index for files a filtered run did not regenerate, which were left untouched"""
+    generated_paths = {record['path'] for record in records}
+    return [
+        {**record, 'status': 'unchanged'}
+        for record in (previous_index or {}).get('files', [])
+        if record['path'] not in generated_paths and record['status'] != 'deleted'
+    ]
+
+
+def load_build_times(output_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(output_dir, BUILD_TIMES_FILENAME), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_build_times(output_dir: str, build_times: dict):
+    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+    with open(os.path.join(output_dir, BUILD_TIMES_FILENAME), 'w') as f:
+        json.dump(build_times, f, indent=2, sort_keys=True)
+
+
+def load_output_index(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'r') as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if index.get('version') != OUTPUT_INDEX_VERSION:
+        return None
+    return index
+
+
+def write_output_index(path: str, records: List[dict]):
+    index = {
+        'version': OUTPUT_INDEX_VERSION,
+        'generated_at': utc_now(),
+        'files': records,
+    }
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(index, f, indent=2)
+
+
+def summarise_records(records: List[dict]) -> Dict[str, int]:
+    summary = {'new': 0, 'changed': 0, 'unchanged': 0, 'deleted': 0}
+    for record in records:
+        summary[record['status']] += 1
+    return summary
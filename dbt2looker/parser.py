@@ -1,22 +1,39 @@
 import logging
-from typing import Dict, Optional, List
+import re
+from typing import Dict, Optional, List, Tuple
 from functools import reduce
 
+from . import interning
+from . import metrics
 from . import models
+from . import sharding
 
 
 def parse_dbt_project_config(raw_config: dict):
     return models.DbtProjectConfig(**raw_config)
 
 
-def parse_catalog_nodes(raw_catalog: dict):
-    catalog = models.DbtCatalog(**raw_catalog)
+def _shard_raw_nodes(raw_nodes: dict, shard: Optional[Tuple[int, int]]) -> dict:
+    # Drop models of other shards before validating, so each shard only pays
+    # for parsing its own share of the project
+    if shard is None:
+        return raw_nodes
+    return {
+        unique_id: node
+        for unique_id, node in raw_nodes.items()
+        if not unique_id.startswith('model.') or sharding.in_shard(unique_id, shard)
+    }
+
+
+def parse_catalog_nodes(raw_catalog: dict, shard: Optional[Tuple[int, int]] = None):
+    catalog = models.DbtCatalog(**{**raw_catalog, 'nodes': _shard_raw_nodes(raw_catalog['nodes'], shard)})
     return catalog.nodes
 
 
 def parse_adapter_type(raw_manifest: dict):
-    manifest = models.DbtManifest(**raw_manifest)
-    return manifest.metadata.adapter_type
+    # Only the metadata is needed, validating all nodes again would be wasted work
+    metadata = models.DbtManifestMetadata(**raw_manifest['metadata'])
+    return metadata.adapter_type
 
 
 def tags_match(query_tag: str, model: models.DbtModel) -> bool:
@@ -41,13 +58,160 @@ def _keep_dbt_node(node: models.DbtModel, tag=None) -> bool:
         return tags_match(tag, node)
     return True
 
-def parse_models(raw_manifest: dict, tag=None) -> List[models.DbtModel]:
-    manifest = models.DbtManifest(**raw_manifest)
-    return [
+def parse_models(raw_manifest: dict, tag=None, shard: Optional[Tuple[int, int]] = None, unique_ids: Optional[List[str]] = None) -> List[models.DbtModel]:
+    manifest = models.DbtManifest(**{**raw_manifest, 'nodes': _shard_raw_nodes(raw_manifest['nodes'], shard)})
+    selected = None if unique_ids is None else set(unique_ids)
+    dbt_models = [
         node
         for node in manifest.nodes.values()
-        if _keep_dbt_node(node, tag)
+        if _keep_dbt_node(node, tag) and (selected is None or node.unique_id in selected)
     ]
+    metrics.count('dbt2looker_models_selected', len(dbt_models))
+    metrics.count(
+        'dbt2looker_models_skipped',
+        sum(unique_id.startswith('model.') for unique_id in raw_manifest['nodes']) - len(dbt_models),
+    )
+    return dbt_models
+
+# ref('model') or ref('package', 'model') in the "to" argument of relationships tests
+REF_NAME = re.compile(r"""ref\(\s*(?:['"][^'"]+['"]\s*,\s*)?['"]([^'"]+)['"]""")
+
+
+def _ref_name(expression: Optional[str]) -> Optional[str]:
+    match = REF_NAME.search(expression or '')
+    return match.group(1) if match else None
+
+
+def _model_with_name(unique_ids: List[str], name: Optional[str]) -> Optional[str]:
+    for unique_id in unique_ids:
+        if unique_id.startswith('model.') and unique_id.endswith(f'.{name}'):
+            return unique_id
+    return None
+
+
+def _parent_column(raw_node: dict, raw_catalog_node: dict, column_name: str) -> Optional[models.DbtModelColumn]:
+    # The referenced column with its catalog type, so the generator can name its field
+    columns = {name.lower(): column for name, column in raw_node.get('columns', {}).items()}
+    if column_name not in columns:
+        return None
+    catalog_columns = {name.lower(): column for name, column in raw_catalog_node.get('columns', {}).items()}
+    return models.DbtModelColumn(**{
+        **columns[column_name],
+        'name': column_name,
+        'meta': columns[column_name].get('meta') or {},
+        'data_type': (catalog_columns.get(column_name) or {}).get('type'),
+    })
+
+
+def parse_relationships(raw_manifest: dict, raw_catalog: dict, tag: Optional[str] = None) -> Dict[str, List[models.DbtRelationship]]:
+    """Index dbt relationships tests by the unique id of the model they test, in one pass over the manifest
+
+    Only tests whose referenced model gets a looker view are kept.
+    """
+    nodes = raw_manifest.get('nodes', {})
+    catalog_nodes = raw_catalog.get('nodes', {})
+    parent_map = raw_manifest.get('parent_map') or {}
+    relationships = {}
+    for unique_id, node in nodes.items():
+        if node.get('resource_type') != 'test':
+            continue
+        test_metadata = node.get('test_metadata') or {}
+        if test_metadata.get('name') != 'relationships':
+            continue
+        kwargs = test_metadata.get('kwargs') or {}
+        column_name, field = kwargs.get('column_name'), kwargs.get('field')
+        if not column_name or not field:
+            continue
+        depends_on = parent_map.get(unique_id) or (node.get('depends_on') or {}).get('nodes', [])
+        parent_id = _model_with_name(depends_on, _ref_name(kwargs.get('to')))
+        child_id = node.get('attached_node') or _model_with_name(depends_on, _ref_name(kwargs.get('model')))
+        if parent_id is None or child_id is None or parent_id not in nodes or child_id not in nodes:
+            logging.debug('Cannot infer a join from relationships test %s', unique_id)
+            continue
+        parent = nodes[parent_id]
+        if parent.get('relation_name') is None or parent_id not in catalog_nodes or (tag is not None and tag not in parent.get('tags', [])):
+            logging.debug('Relationships test %s references model %s, which has no looker view', unique_id, parent_id)
+            continue
+        parent_column = _parent_column(parent, catalog_nodes[parent_id], field.lower())
+        if parent_column is None:
+            logging.debug('Relationships test %s references a column without documentation', unique_id)
+            continue
+        parent_meta = (parent.get('config') or {}).get('meta') or {}
+        relationships.setdefault(child_id, []).append(models.DbtRelationship(
+            child_unique_id=child_id,
+            column_name=column_name.lower(),
+            parent_unique_id=parent_id,
+            parent_view_name=parent_meta.get('view_name') or parent['name'],
+            parent_column=parent_column,
+        ))
+    logging.debug('Found relationships tests for %d models', len(relationships))
+    return relationships
+
+
+BUILD_COMMANDS = ('run', 'build')
+
+
+def _completed_at(result: dict, generated_at: Optional[str]) -> Optional[str]:
+    for timing in result.get('timing') or []:
+        if timing.get('name') == 'execute' and timing.get('completed_at'):
+            return timing['completed_at']
+    return generated_at
+
+
+def parse_run_results(raw_run_results: dict, raw_manifest: dict) -> models.DbtBuildTimes:
+    """Latest build time of each looker view and dbt tag, from the models dbt built successfully
+
+    Models that failed or were not part of the run have no build time. Only
+    the results of dbt run and dbt build are read, other commands such as
+    dbt docs generate or dbt test also write run_results.json without
+    building any model.
+    """
+    nodes = raw_manifest.get('nodes', {})
+    generated_at = (raw_run_results.get('metadata') or {}).get('generated_at')
+    build_times = models.DbtBuildTimes()
+    command = (raw_run_results.get('args') or {}).get('which')
+    if command not in BUILD_COMMANDS:
+        written_by = f"the '{command}' command" if command else 'an unknown dbt command'
+        logging.warning(f'Ignoring run_results.json written by {written_by}, build times are only read from dbt run and dbt build')
+        return build_times
+    for result in raw_run_results.get('results', []):
+        node = nodes.get(result.get('unique_id'))
+        if node is None or node.get('resource_type') != 'model' or result.get('status') != 'success':
+            continue
+        completed_at = _completed_at(result, generated_at)
+        if completed_at is None:
+            continue
+        meta = (node.get('config') or {}).get('meta') or {}
+        for times, key in (
+            (build_times.views, meta.get('view_name') or node['name']),
+            *((build_times.tags, tag) for tag in node.get('tags', [])),
+        ):
+            # Timestamps in run_results.json are ISO 8601 in UTC, so they sort as strings
+            times[key] = max(times.get(key, completed_at), completed_at)
+    logging.debug('Found build times for %d views in run results', len(build_times.views))
+    return build_times
+
+
+def merge_build_times(previous: Optional[models.DbtBuildTimes], current: models.DbtBuildTimes) -> models.DbtBuildTimes:
+    """Latest build times of both, so that models left out of a partial dbt run keep their build time"""
+    if previous is None:
+        return current
+    return models.DbtBuildTimes(**{
+        field: {
+            key: max(times)
+            for key, times in _zip_dicts(getattr(previous, field), getattr(current, field)).items()
+        }
+        for field in ('views', 'tags')
+    })
+
+
+def _zip_dicts(*dicts: Dict[str, str]) -> Dict[str, List[str]]:
+    zipped = {}
+    for d in dicts:
+        for key, value in d.items():
+            zipped.setdefault(key, []).append(value)
+    return zipped
+
 
 def check_models_for_missing_column_types(dbt_typed_models: List[models.DbtModel]):
     for model in dbt_typed_models:
@@ -55,9 +219,23 @@ def check_models_for_missing_column_types(dbt_typed_models: List[models.DbtModel
             logging.debug('Model %s has no typed columns, no dimensions will be generated. %s', model.unique_id, model)
 
 
-def parse_typed_models(raw_manifest: dict, raw_catalog: dict, tag: Optional[str] = None):
-    catalog_nodes = parse_catalog_nodes(raw_catalog)
-    dbt_models = parse_models(raw_manifest, tag=tag)
+def undocumented_partition_columns(catalog_nodes: Dict[str, models.DbtCatalogNode], model: models.DbtModel) -> List[models.DbtModelColumn]:
+    # Partition and cluster columns of partitioned models get dimensions for
+    # query filters even when they are not documented in the model's yml
+    if model.config is None or not model.config.partition_by:
+        return []
+    column_names = [p.field for p in model.config.partition_by or []] + (model.config.cluster_by or [])
+    catalog_columns = catalog_nodes[model.unique_id].columns
+    return [
+        models.DbtModelColumn(name=name, meta=models.DbtModelColumnMeta())
+        for name in dict.fromkeys(column_names)
+        if name not in model.columns and name in catalog_columns
+    ]
+
+
+def parse_typed_models(raw_manifest: dict, raw_catalog: dict, tag: Optional[str] = None, shard: Optional[Tuple[int, int]] = None, unique_ids: Optional[List[str]] = None):
+    catalog_nodes = parse_catalog_nodes(raw_catalog, shard=shard)
+    dbt_models = parse_models(raw_manifest, tag=tag, shard=shard, unique_ids=unique_ids)
     adapter_type = parse_adapter_type(raw_manifest)
 
     logging.debug('Parsed %d models from manifest.json', len(dbt_models))
@@ -82,15 +260,16 @@ def parse_typed_models(raw_manifest: dict, raw_catalog: dict, tag: Optional[str]
             column.name: column.copy(update={
                 'data_type': get_column_type_from_catalog(catalog_nodes, model.unique_id, column.name)
             })
-            for column in model.columns.values()
+            for column in [*model.columns.values(), *undocumented_partition_columns(catalog_nodes, model)]
         }})
         for model in dbt_models
         if model.unique_id in catalog_nodes
     ]
     logging.debug('Found catalog entries for %d models', len(dbt_typed_models))
     logging.debug('Catalog entries missing for %d models', len(dbt_models) - len(dbt_typed_models))
+    metrics.count('dbt2looker_models_missing_from_catalog', len(dbt_models) - len(dbt_typed_models))
     check_models_for_missing_column_types(dbt_typed_models)
-    return dbt_typed_models
+    return interning.intern_models(dbt_typed_models)
 
 
 def get_column_type_from_catalog(catalog_nodes: Dict[str, models.DbtCatalogNode], model_id: str, column_name: str):
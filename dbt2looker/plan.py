@@ -0,0 +1,105 @@
+import difflib
+import logging
+import os
+from typing import Callable, Dict, List, Optional
+
+from . import models
+from . import output
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _is_unchanged(output_dir: str, previous_records: List[dict], fingerprint: str) -> bool:
+    # The inputs match the previous run and nobody edited the generated files since
+    return bool(previous_records) and all(
+        record.get('fingerprint') == fingerprint
+        and output.file_hash(os.path.join(output_dir, record['path'])) == record['sha256']
+        for record in previous_records
+    )
+
+
+def plan_changes(
+    output_dir: str,
+    typed_dbt_models: List[models.DbtModel],
+    fingerprints: Dict[str, str],
+    render: Callable[[List[models.DbtModel]], List[output.OutputFile]],
+    previous_index: Optional[dict] = None,
+    detect_deleted: bool = True,
+) -> dict:
+    """Work out which lookml files generation would add, modify or delete
+
+    Only models whose input fingerprint differs from the previous output index
+    are rendered. Deleted files are those of the previous output index that a
+    run over all models would delete.
+    """
+    previous_by_model = {}
+    for record in (previous_index or {}).get('files', []):
+        if record['status'] != 'deleted':
+            previous_by_model.setdefault(record['unique_id'], []).append(record)
+
+    changed_models = [
+        model for model in typed_dbt_models
+        if not _is_unchanged(output_dir, previous_by_model.get(model.unique_id, []), fingerprints[model.unique_id])
+    ]
+    changed_ids = {model.unique_id for model in changed_models}
+    logging.debug('Rendering %d of %d models with changed inputs', len(changed_models), len(typed_dbt_models))
+
+    plan = {'add': [], 'modify': [], 'delete': [], 'unchanged': 0}
+    rendered_paths = set()
+    for output_file in render(changed_models):
+        rendered_paths.add(output_file.path)
+        existing = _read(os.path.join(output_dir, output_file.path))
+        if existing is None:
+            plan['add'].append({'path': output_file.path, 'unique_id': output_file.unique_id})
+        elif existing != output_file.contents:
+            diff = ''.join(difflib.unified_diff(
+                existing.splitlines(keepends=True),
+                output_file.contents.splitlines(keepends=True),
+                fromfile=f'a/{output_file.path}',
+                tofile=f'b/{output_file.path}',
+            ))
+            plan['modify'].append({'path': output_file.path, 'unique_id': output_file.unique_id, 'diff': diff})
+        else:
+            plan['unchanged'] += 1
+    plan['unchanged'] += sum(
+        len(previous_by_model[model.unique_id])
+        for model in typed_dbt_models
+        if model.unique_id not in changed_ids
+    )
+
+    # A run over all models deletes the files of the previous index it does
+    # not generate again, see output.delete_stale_files. Files of unchanged
+    # models are generated again with the same paths.
+    if detect_deleted:
+        unchanged_ids = {model.unique_id for model in typed_dbt_models} - changed_ids
+        plan['delete'] = [
+            {'path': path}
+            for path in sorted({
+                record['path']
+                for unique_id, records in previous_by_model.items()
+                if unique_id not in unchanged_ids
+                for record in records
+                if record['path'] not in rendered_paths and output.is_stale_file(output_dir, record)
+            })
+        ]
+    return plan
+
+
+def format_plan(plan: dict, show_diff: bool = True) -> str:
+    lines = []
+    lines += [f'+ {change["path"]}' for change in plan['add']]
+    lines += [f'~ {change["path"]}' for change in plan['modify']]
+    lines += [f'- {change["path"]}' for change in plan['delete']]
+    lines.append(
+        f'Plan: {len(plan["add"])} to add, {len(plan["modify"])} to modify, '
+        f'{len(plan["delete"])} to delete, {plan["unchanged"]} unchanged'
+    )
+    if show_diff:
+        lines += [change['diff'] for change in plan['modify']]
+    return '\n'.join(lines)
@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import socketserver
+import stat
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, NamedTuple, Optional
+from urllib.parse import parse_qs, urlparse
+
+from . import api
+from . import artifacts
+from . import generator
+from . import parser
+
+
+class LoadedProject(NamedTuple):
+    project: object
+    models: dict
+    # Models by view name and model name
+    names: dict
+    rendered: dict
+
+
+class ProjectState:
+    """Parsed dbt artifacts of a project, reloaded when the artifacts change on disk
+
+    Rendered lookml is cached per model until the next reload.
+    """
+
+    def __init__(self, args, load_project: Callable):
+        self.args = args
+        # Reads the artifacts and returns an api.Project
+        self.load_project = load_project
+        self.lock = threading.Lock()
+        self.fingerprints = None
+        # Replaced as a whole on reload, so that requests always render from
+        # one project and cache into that project's cache
+        self.loaded = LoadedProject(None, {}, {}, {})
+
+    def current_fingerprints(self) -> Dict[str, object]:
+        fingerprints = {}
+        # Datagroup triggers come from run_results.json
+        filenames = ('manifest.json', 'catalog.json', 'run_results.json') if self.args.datagroups else ('manifest.json', 'catalog.json')
+        for filename in filenames:
+            try:
+                path = artifacts.find_artifact(self.args.target_dir, filename)
+                fingerprints[path] = artifacts.artifact_fingerprint(path)
+            except FileNotFoundError:
+                fingerprints[filename] = None
+        project_path = os.path.join(self.args.project_dir, 'dbt_project.yml')
+        fingerprints[project_path] = artifacts.artifact_fingerprint(project_path) if os.path.exists(project_path) else None
+        return fingerprints
+
+    def refresh(self):
+        fingerprints = self.current_fingerprints()
+        if fingerprints == self.fingerprints:
+            return
+        with self.lock:
+            if fingerprints == self.fingerprints:
+                return
+            logging.info('Loading dbt artifacts from %s', self.args.target_dir)
+            try:
+                project = self.load_project(self.args)
+            except (Exception, SystemExit) as e:
+                if self.fingerprints is None:
+                    raise
+                logging.error('Could not reload dbt artifacts, serving previous state: %s', e)
+                return
+            if project.build_times is not None and self.loaded.project is not None:
+                # Keep build times of models that the latest dbt run did not build
+                project = project._replace(build_times=parser.merge_build_times(self.loaded.project.build_times, project.build_times))
+            typed_dbt_models = project.typed_dbt_models
+            self.loaded = LoadedProject(
+                project=project,
+                models={model.unique_id: model for model in typed_dbt_models},
+                # View names take precedence over model names
+                names={
+                    **{model.name: model for model in typed_dbt_models},
+                    **{model.config.meta.view_name or model.name: model for model in typed_dbt_models},
+                },
+                rendered={},
+            )
+            self.fingerprints = fingerprints
+            logging.info('Loaded %d models', len(typed_dbt_models))
+
+    @staticmethod
+    def _find_model(loaded: LoadedProject, name: str):
+        return loaded.models.get(name) or loaded.names.get(name)
+
+    def find_model(self, name: str):
+        """Find a model by unique id, view name or model name"""
+        return self._find_model(self.loaded, name)
+
+    def render(self, kind: str, name: str) -> Optional[str]:
+        loaded = self.loaded
+        model = self._find_model(loaded, name)
+        if model is None:
+            return None
+        key = (kind, model.unique_id)
+        if key not in loaded.rendered:
+            if kind == 'view':
+                loaded.rendered[key] = generator.lookml_view_file(api.get_view_dicts(loaded.project, [model])[0]).contents
+            else:
+                loaded.rendered[key] = generator.lookml_model_file(api.get_model_dicts(loaded.project, [model])[0]).contents
+        return loaded.rendered[key]
+
+    def list_models(self, tag: Optional[str] = None):
+        return [
+            {
+                'unique_id': model.unique_id,
+                'name': model.name,
+                'view_name': model.config.meta.view_name or model.name,
+                'tags': model.tags,
+            }
+            for model in self.loaded.models.values()
+            if tag is None or parser.tags_match(tag, model)
+        ]
+
+
+class LookmlRequestHandler(BaseHTTPRequestHandler):
+    """GET /views/<name>, /explores/<name>, /models?tag=<tag> and /health"""
+    state: ProjectState = None
+
+    def send_body(self, status: int, body: str, content_type: str = 'text/plain; charset=utf-8'):
+        encoded = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if parts == ['health']:
+            return self.send_body(200, 'ok\n')
+        try:
+            self.state.refresh()
+        except (Exception, SystemExit) as e:
+            return self.send_body(500, f'Could not load dbt artifacts: {e}\n')
+        if parts == ['models']:
+            tag = parse_qs(url.query).get('tag', [None])[0]
+            return self.send_body(200, json.dumps(self.state.list_models(tag)), 'application/json')
+        if len(parts) == 2 and parts[0] in ('views', 'explores'):
+            contents = self.state.render('view' if parts[0] == 'views' else 'explore', parts[1])
+            if contents is None:
+                return self.send_body(404, f'No model named {parts[1]}\n')
+            return self.send_body(200, contents)
+        return self.send_body(404, 'Not found\n')
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix-socket'
+
+    def log_message(self, format, *args):
+        logging.debug('%s %s', self.address_string(), format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def remove_stale_socket(socket_path: str):
+    if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        os.remove(socket_path)
+
+
+def serve(state: ProjectState, host: str = '127.0.0.1', port: int = 8000, socket_path: Optional[str] = None):
+    handler = type('Handler', (LookmlRequestHandler,), {'state': state})
+    if socket_path:
+        remove_stale_socket(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        logging.info('Serving lookml on unix socket %s', socket_path)
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        logging.info('Serving lookml on http://%s:%d', host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path:
+            remove_stale_socket(socket_path)
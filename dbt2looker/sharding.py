@@ -0,0 +1,100 @@
+import glob
+import logging
+import os
+import pathlib
+import shutil
+import zlib
+from typing import Dict, List, Tuple
+
+from . import output
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse a shard specification "i/N" with 1 <= i <= N"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f'Shard "{value}" must be formatted as i/N, e.g. 1/4')
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f'Shard "{value}" must satisfy 1 <= i <= N')
+    return index, count
+
+
+def shard_of(unique_id: str, shard_count: int) -> int:
+    # crc32 is stable across processes and machines, unlike hash()
+    return zlib.crc32(unique_id.encode('utf-8')) % shard_count + 1
+
+
+def in_shard(unique_id: str, shard: Tuple[int, int]) -> bool:
+    index, count = shard
+    return shard_of(unique_id, count) == index
+
+
+def _shard_files(shard_dir: str) -> List[str]:
+    views = glob.glob(os.path.join(shard_dir, 'views', '*.view.lkml'))
+    models = glob.glob(os.path.join(shard_dir, '*.model.lkml'))
+    return [os.path.relpath(path, shard_dir) for path in sorted(views) + sorted(models)]
+
+
+def merge_shard_outputs(shard_dirs: List[str], output_dir: str) -> Dict[str, str]:
+    """Copy the lookml generated by each shard into output_dir, failing on view name collisions
+
+    The output indexes and build times the shards wrote to their output
+    directories are merged into output_dir as well.
+    """
+    sources = {}
+    collisions = []
+    for shard_dir in shard_dirs:
+        for relative_path in _shard_files(shard_dir):
+            if relative_path in sources:
+                collisions.append((relative_path, sources[relative_path], shard_dir))
+                continue
+            sources[relative_path] = shard_dir
+    for relative_path, first_dir, second_dir in collisions:
+        logging.error('%s was generated by more than one shard: %s and %s', relative_path, first_dir, second_dir)
+    if collisions:
+        raise SystemExit('Failed')
+
+    pathlib.Path(os.path.join(output_dir, 'views')).mkdir(parents=True, exist_ok=True)
+    for relative_path, shard_dir in sources.items():
+        shutil.copyfile(os.path.join(shard_dir, relative_path), os.path.join(output_dir, relative_path))
+    _merge_output_indexes(shard_dirs, output_dir, sources)
+    _merge_build_times(shard_dirs, output_dir)
+    return sources
+
+
+def _merge_output_indexes(shard_dirs: List[str], output_dir: str, sources: Dict[str, str]):
+    # Records of the files copied from each shard, from the shard's own output index
+    records = []
+    indexed_shards = 0
+    for shard_dir in shard_dirs:
+        index = output.load_output_index(os.path.join(shard_dir, output.DEFAULT_OUTPUT_INDEX_FILENAME))
+        if index is None:
+            continue
+        indexed_shards += 1
+        records += [
+            record
+            for record in index['files']
+            if sources.get(record['path']) == shard_dir
+        ]
+    if indexed_shards == 0:
+        return
+    if indexed_shards < len(shard_dirs):
+        logging.warning(f'Only {indexed_shards} of {len(shard_dirs)} shards wrote an output index, the merged index misses the files of the others')
+    output.write_output_index(os.path.join(output_dir, output.DEFAULT_OUTPUT_INDEX_FILENAME), records)
+
+
+def _merge_build_times(shard_dirs: List[str], output_dir: str):
+    # Latest build time of each view and tag over all shards
+    merged = None
+    for shard_dir in shard_dirs:
+        build_times = output.load_build_times(shard_dir)
+        if build_times is None:
+            continue
+        merged = merged or {'views': {}, 'tags': {}}
+        for key, times in merged.items():
+            for name, built_at in (build_times.get(key) or {}).items():
+                # ISO 8601 timestamps in UTC sort as strings
+                times[name] = max(times.get(name, built_at), built_at)
+    if merged is not None:
+        output.write_build_times(output_dir, merged)
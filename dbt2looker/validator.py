@@ -0,0 +1,139 @@
+import re
+from typing import Dict, Iterable, List, Set
+
+# ${view.field} references, e.g. in explore join sql_on
+FIELD_REFERENCE = re.compile(r'\$\{(\w+)\.(\w+)\}')
+# References that are not fields of a view
+SPECIAL_REFERENCES = {'SQL_TABLE_NAME', 'TABLE'}
+
+
+def view_field_names(view: dict) -> Set[str]:
+    """Names of all fields generated for a view, with one name per dimension_group timeframe"""
+    return {
+        *(
+            f'{dimension_group["name"]}_{timeframe}'
+            for dimension_group in view.get('dimension_groups', [])
+            for timeframe in dimension_group.get('timeframes', [])
+        ),
+        *(dimension['name'] for dimension in view.get('dimensions', [])),
+        *(measure['name'] for measure in view.get('measures', [])),
+    }
+
+
+def build_field_index(views: Iterable[dict]) -> Dict[str, Set[str]]:
+    return {
+        lookml['view']['name']: view_field_names(lookml['view'])
+        for lookml in views
+    }
+
+
+def _check_field(field_index: Dict[str, Set[str]], view_name: str, field: str, context: str) -> List[str]:
+    # Fields may be qualified with another view name, e.g. users.id
+    if '.' in field:
+        view_name, field = field.split('.', 1)
+    if view_name not in field_index:
+        return []
+    if field not in field_index[view_name]:
+        return [f'{context} references unknown field {view_name}.{field}']
+    return []
+
+
+def _drill_field_list(drill_fields) -> List[str]:
+    # The generated views use the lookml string form, e.g. '[details*]'
+    if isinstance(drill_fields, str):
+        return [field.strip() for field in drill_fields.strip('[]').split(',') if field.strip()]
+    return list(drill_fields)
+
+
+def _check_drill_fields(field_index: Dict[str, Set[str]], set_names: Set[str], view_name: str, drill_fields, context: str) -> List[str]:
+    errors = []
+    for field in _drill_field_list(drill_fields):
+        if field.endswith('*'):
+            if field[:-1] not in set_names:
+                errors.append(f'{context} references unknown set {field[:-1]}')
+        else:
+            errors += _check_field(field_index, view_name, field, context)
+    return errors
+
+
+def validate_view(field_index: Dict[str, Set[str]], view: dict) -> List[str]:
+    view_name = view['name']
+    sets = view.get('set', [])
+    sets = [sets] if isinstance(sets, dict) else sets
+    set_names = {s['name'] for s in sets}
+    errors = []
+    if 'drill_fields' in view:
+        errors += _check_drill_fields(field_index, set_names, view_name, view['drill_fields'], f'View {view_name} drill_fields')
+    for s in sets:
+        for field in s.get('fields', []):
+            errors += _check_field(field_index, view_name, field, f'View {view_name} set {s["name"]}')
+    for measure in view.get('measures', []):
+        context = f'View {view_name} measure {measure["name"]}'
+        for f in measure.get('filters', []):
+            for field in f:
+                errors += _check_field(field_index, view_name, field, f'{context} filters')
+        if 'drill_fields' in measure:
+            errors += _check_drill_fields(field_index, set_names, view_name, measure['drill_fields'], f'{context} drill_fields')
+        if 'list_field' in measure:
+            errors += _check_field(field_index, view_name, measure['list_field'], f'{context} list_field')
+    return errors
+
+
+def validate_explore(field_index: Dict[str, Set[str]], explore: dict) -> List[str]:
+    explore_name = explore['name']
+    joins = explore.get('joins', [])
+    # Name in the explore -> generated view, joins may alias a view with "from"
+    views_in_explore = {
+        explore_name: explore.get('from', explore_name),
+        **{join['name']: join.get('from', join['name']) for join in joins},
+    }
+    errors = []
+    for join in joins:
+        context = f'Explore {explore_name} join {join["name"]} sql_on'
+        for view_name, field in FIELD_REFERENCE.findall(join.get('sql_on') or ''):
+            if field in SPECIAL_REFERENCES:
+                continue
+            if view_name not in views_in_explore:
+                errors.append(f'{context} references view {view_name}, which is not part of the explore')
+                continue
+            errors += _check_field(field_index, views_in_explore[view_name], field, context)
+    for parameter in ('always_filter', 'conditionally_filter'):
+        explore_filter = explore.get(parameter, {})
+        fields = [
+            *(field for f in explore_filter.get('filters', []) for field in f),
+            *explore_filter.get('unless', []),
+        ]
+        for field in fields:
+            errors += _check_field(field_index, views_in_explore[explore_name], field, f'Explore {explore_name} {parameter}')
+    for aggregate_table in explore.get('aggregate_tables', []):
+        context = f'Explore {explore_name} aggregate_table {aggregate_table["name"]}'
+        query = aggregate_table.get('query', {})
+        fields = [
+            *query.get('dimensions', []),
+            *query.get('measures', []),
+            *(field for f in query.get('filters', []) for field in f),
+        ]
+        for field in fields:
+            view_name, field = field.split('.', 1) if '.' in field else (explore_name, field)
+            if view_name not in views_in_explore:
+                errors.append(f'{context} references view {view_name}, which is not part of the explore')
+                continue
+            errors += _check_field(field_index, views_in_explore[view_name], field, context)
+        increment_key = aggregate_table.get('materialization', {}).get('increment_key')
+        if increment_key:
+            errors += _check_field(field_index, views_in_explore[explore_name], increment_key, f'{context} increment_key')
+    return errors
+
+
+def validate_lookml(views: List[dict], lookml_models: List[dict]) -> List[str]:
+    """Check field references in generated views and explores against the generated fields
+
+    References to views that were not generated in this run cannot be checked and are skipped.
+    """
+    field_index = build_field_index(views)
+    errors = []
+    for lookml in views:
+        errors += validate_view(field_index, lookml['view'])
+    for lookml in lookml_models:
+        errors += validate_explore(field_index, lookml['explore'])
+    return errors
@@ -0,0 +1,72 @@
+from dbt2looker import api
+
+
+MANIFEST = {
+    'metadata': {'adapter_type': 'bigquery'},
+    'nodes': {
+        'model.shop.orders': {
+            'unique_id': 'model.shop.orders',
+            'resource_type': 'model',
+            'relation_name': '`project`.`shop`.`orders`',
+            'schema': 'shop',
+            'name': 'orders',
+            'description': 'One row per order',
+            'tags': [],
+            'config': {'meta': {}, 'materialized': 'table'},
+            'columns': {
+                'id': {'name': 'id', 'description': 'Primary key', 'meta': {}},
+                'created_at': {'name': 'created_at', 'description': '', 'meta': {}},
+            },
+        },
+    },
+    'sources': {},
+}
+
+CATALOG = {
+    'metadata': {},
+    'nodes': {
+        'model.shop.orders': {
+            'metadata': {'type': 'table', 'schema': 'shop', 'name': 'orders', 'comment': None, 'owner': None},
+            'columns': {
+                'ID': {'type': 'INT64', 'comment': None, 'index': 1, 'name': 'ID'},
+                'CREATED_AT': {'type': 'TIMESTAMP', 'comment': None, 'index': 2, 'name': 'CREATED_AT'},
+            },
+        },
+    },
+    'sources': {},
+}
+
+
+class FakeWritableManifest:
+    def to_dict(self):
+        return MANIFEST
+
+
+class FakeManifest:
+    # dbt's Manifest, as returned by dbtRunner().invoke(['parse']).result
+    def writable_manifest(self):
+        return FakeWritableManifest()
+
+
+class FakeCatalogArtifact:
+    # dbt's CatalogArtifact, as returned by dbtRunner().invoke(['docs', 'generate']).result
+    def to_dict(self):
+        return CATALOG
+
+
+def test_generate_lookml_from_dbt_objects():
+    lookml = api.generate_lookml(FakeManifest(), FakeCatalogArtifact(), connection_name='warehouse')
+
+    assert [view.filename for view in lookml.views] == ['orders.view.lkml']
+    assert [model.filename for model in lookml.models] == ['orders.model.lkml']
+    assert 'dimension: id' in lookml.views[0].contents
+    assert 'dimension_group: created_at' in lookml.views[0].contents
+    assert 'connection: "warehouse"' in lookml.models[0].contents
+    assert lookml.validation_errors == []
+
+
+def test_generate_lookml_from_dicts_matches_dbt_objects():
+    from_objects = api.generate_lookml(FakeManifest(), FakeCatalogArtifact(), connection_name='warehouse')
+    from_dicts = api.generate_lookml(MANIFEST, CATALOG, connection_name='warehouse')
+
+    assert from_dicts == from_objects